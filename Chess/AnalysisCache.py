@@ -0,0 +1,153 @@
+"""
+Persistent analysis cache: the results of findBestMove kept in an SQLite file, so a position that was analysed before,
+in this run of the program or an earlier one, does not have to be searched again.
+
+An entry is keyed by the zobrist key of the position and holds the best move, its score (from the point of view of the
+side to move), the depth of the search and its principal variation. The file holds at most maxEntries positions, the
+ones looked up or stored the longest time ago are evicted first. The scores depend on the evaluation and the search,
+so the entries are dropped when the file is opened with different piece values, piece-square tables or
+SmartMoveFinder.SCORE_PARAMETERS (the pawn structure terms, the quiescence depth) than it was filled with.
+
+The engine uses the cache when SmartMoveFinder.analysisCache is set: a cached search at least DEPTH deep is answered
+without searching, a shallower one puts its move first in the search.
+
+Usage (from the repository root):
+    python -m Chess.AnalysisCache stats
+    python -m Chess.AnalysisCache clear
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from Chess import SmartMoveFinder
+
+CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                          "chess", "analysis.sqlite")
+MAX_ENTRIES = 200000
+EVICT_INTERVAL = 100    #stores between two checks of the size of the file
+LOCK_TIMEOUT = 5.0      #seconds to wait for another process writing to the file
+
+
+'''
+The zobrist keys are unsigned 64 bit numbers, SQLite integers are signed
+'''
+def toSigned(key):
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+'''
+A fingerprint of the current evaluation and search parameters, the cached scores are only valid for the ones they were
+searched with
+'''
+def evaluationHash():
+    evaluation = SmartMoveFinder.getEvaluation()
+    for name in SmartMoveFinder.SCORE_PARAMETERS:
+        evaluation[name] = getattr(SmartMoveFinder, name)
+    return hashlib.sha1(json.dumps(evaluation, sort_keys=True).encode()).hexdigest()
+
+
+class AnalysisCache():
+    def __init__(self, path=CACHE_FILE, maxEntries=MAX_ENTRIES):
+        self.path = path
+        self.maxEntries = maxEntries
+        self.connection = None
+        self.pid = None     #the process the connection was opened in, a connection can not be shared with a child
+        self.stores = 0
+        self.hits = 0
+        self.misses = 0
+
+    '''
+    The connection is opened on first use in each process, so the cache can be set up before the engine process starts
+    '''
+    def connect(self):
+        if self.connection is not None and self.pid == os.getpid():
+            return self.connection
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None)
+        self.pid = os.getpid()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS analysis (key INTEGER PRIMARY KEY, move INTEGER, score REAL, "
+                                "depth INTEGER, pv TEXT, lastUsed REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS analysisLastUsed ON analysis (lastUsed)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        evaluation = evaluationHash()
+        row = self.connection.execute("SELECT value FROM meta WHERE name = 'evaluation'").fetchone()
+        if row is None or row[0] != evaluation:
+            self.connection.execute("DELETE FROM analysis")
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('evaluation', ?)", (evaluation,))
+        self.evict()
+        return self.connection
+
+    '''
+    The cached analysis of the position with this zobrist key as (moveID, score, depth, pv as a list of moveIDs), or
+    None. A hit counts as a use for the eviction.
+    '''
+    def lookup(self, key):
+        connection = self.connect()
+        row = connection.execute("SELECT move, score, depth, pv FROM analysis WHERE key = ?", (toSigned(key),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        connection.execute("UPDATE analysis SET lastUsed = ? WHERE key = ?", (time.time(), toSigned(key)))
+        return row[0], row[1], row[2], [int(moveID) for moveID in row[3].split()]
+
+    '''
+    Records the analysis of a position. An entry of a deeper search than this one is kept.
+    '''
+    def store(self, key, moveID, score, depth, pv):
+        connection = self.connect()
+        connection.execute("INSERT INTO analysis VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                           "move = excluded.move, score = excluded.score, depth = excluded.depth, pv = excluded.pv, "
+                           "lastUsed = excluded.lastUsed WHERE excluded.depth >= analysis.depth",
+                           (toSigned(key), moveID, score, depth, " ".join(str(pvMoveID) for pvMoveID in pv), time.time()))
+        self.stores += 1
+        if self.stores % EVICT_INTERVAL == 0:
+            self.evict()
+
+    '''
+    Deletes the least recently used entries beyond maxEntries
+    '''
+    def evict(self):
+        count = self.connection.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+        if count > self.maxEntries:
+            self.connection.execute("DELETE FROM analysis WHERE key IN (SELECT key FROM analysis ORDER BY lastUsed "
+                                    "LIMIT ?)", (count - self.maxEntries,))
+
+    def clear(self):
+        self.connect().execute("DELETE FROM analysis")
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.connect().execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+
+    def __getstate__(self):     #pickled for a spawned engine process, which opens its own connection
+        state = dict(self.__dict__)
+        state["connection"] = None
+        state["pid"] = None
+        return state
+
+    def __str__(self):
+        return "analysis cache: %d hits, %d misses" % (self.hits, self.misses)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or clear the persistent analysis cache")
+    parser.add_argument("command", choices=("stats", "clear"))
+    parser.add_argument("--file", default=CACHE_FILE)
+    args = parser.parse_args(argv)
+    cache = AnalysisCache(args.file)
+    if args.command == "clear":
+        cache.clear()
+    depths = cache.connect().execute("SELECT depth, COUNT(*) FROM analysis GROUP BY depth ORDER BY depth").fetchall()
+    print("%s: %d positions" % (args.file, sum(count for depth, count in depths)))
+    for depth, count in depths:
+        print("    depth %d: %d" % (depth, count))
+
+if __name__ == "__main__":
+    main()
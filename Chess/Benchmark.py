@@ -0,0 +1,365 @@
+"""
+Benchmarks and known-answer checks of the engine, run from the repository root:
+    python -m Chess.Benchmark see           #static exchange values of known positions, then SEE calls per second
+    python -m Chess.Benchmark search        #fixed depth search of BENCH_POSITIONS and the tactics of TACTICS_FILE
+    python -m Chess.Benchmark search --save before.json
+    python -m Chess.Benchmark search --baseline before.json     #the same, compared with a saved run
+    python -m Chess.Benchmark seek          #jumps to random plies of a long game, one move at a time and with checkpoints
+    python -m Chess.Benchmark levels        #nodes and time per move of every strength level on BENCH_POSITIONS
+    python -m Chess.Benchmark movegen       #move generation and pin/check detection per position
+
+The search benchmark reports nodes, nodes per second and time to depth at a fixed depth, and the tactics solved at a
+fixed depth and time. Every position starts with empty hash tables and the same random seed, so two runs of the same
+engine search the same nodes.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from Chess import ChessEngine, GameNavigator, MatchRunner, SmartMoveFinder
+
+#(name, FEN) - opening, middlegame and endgame positions for the speed of the search
+BENCH_POSITIONS = [
+    ("start", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -"),
+    ("italian", "r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R b KQkq -"),
+    ("queen's gambit", "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP2BPPP/R2QKB1R w KQ -"),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq -"),
+    ("rook ending", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - -"),
+    ("pawn ending", "8/8/4k3/3p4/3P4/4K3/8/8 w - -"),
+]
+TACTICS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tactics.epd")
+
+#(FEN, move in SAN, exchange value with ChessEngine.exchangeValues) - includes x-rays, the king only recapturing on an
+#undefended square, a quiet move to an attacked square and a promotion
+EXCHANGE_CASES = [
+    ("1k1r4/1pp4p/p7/4p3/8/P5P1/1PP4P/2K1R3 w - -", "Rxe5", 1),
+    ("1k1r3q/1ppn3p/p4b2/4p3/8/P2N2P1/1PP1R1BP/2K1Q3 w - -", "Nxe5", -2),
+    ("4k3/8/3p4/4p3/8/8/8/4QK2 w - -", "Qxe5", -8),
+    ("4k3/8/3p4/4n3/3P4/8/8/4K3 w - -", "dxe5", 2),
+    ("4r1k1/8/8/4p3/8/8/4R3/4R1K1 w - -", "Rxe5", 1),
+    ("3rk3/8/8/3p4/8/8/3R4/3QK3 w - -", "Rxd5", 1),
+    ("8/8/4k3/3p4/8/8/3R4/3QK3 w - -", "Rxd5", 1),
+    ("8/8/4k3/3p4/8/8/3R4/4K3 w - -", "Rxd5", -4),
+    ("4k3/8/8/3q4/8/8/8/3RK3 w - -", "Rxd5", 9),
+    ("4k3/8/4p3/3q4/8/8/8/3RK3 w - -", "Rxd5", 4),
+    ("4k3/8/2p5/8/8/2N5/8/4K3 w - -", "Nb5", -3),
+    ("4k3/8/8/8/8/2N5/8/4K3 w - -", "Nb5", 0),
+    ("4k3/P7/8/8/8/8/8/4K3 w - -", "a8=Q", 8),
+    ("r3k3/8/8/8/8/8/8/R3K3 b - -", "Rxa1", 5),
+    ("4k3/8/5n2/3p4/2P5/8/8/4K3 w - -", "cxd5", 0),
+    ("4k3/8/5n2/3p4/2P5/1B6/8/4K3 w - -", "cxd5", 1),
+]
+
+
+'''
+Checks the static exchange evaluation against the known values. Returns True when all of them match.
+'''
+def checkExchanges():
+    failures = 0
+    for fen, san, expected in EXCHANGE_CASES:
+        gs = ChessEngine.GameState()
+        gs.setFEN(fen)
+        value = gs.staticExchange(gs.parseSAN(san))
+        if value != expected:
+            failures += 1
+            print("%s %s: %d, expected %d" % (fen, san, value, expected))
+    print("%d of %d exchange values correct" % (len(EXCHANGE_CASES) - failures, len(EXCHANGE_CASES)))
+    return failures == 0
+
+'''
+Times the static exchange evaluation of the captures in random positions, next to the make/generate/undo that finding
+out the same by searching would need at the least
+'''
+def benchExchanges(positions=300, seed=0):
+    random.seed(seed)
+    samples = []
+    for i in range(positions):
+        gs = ChessEngine.GameState()
+        for ply in range(random.randint(10, 60)):
+            validMoves = gs.getValidMoves()
+            if not validMoves:
+                break
+            gs.makeMove(random.choice(validMoves))
+        captures = [move for move in gs.getValidMoves() if move.isCapture]
+        if captures:
+            samples.append((gs, captures))
+    calls = sum(len(captures) for gs, captures in samples)
+
+    startTime = time.perf_counter()
+    for gs, captures in samples:
+        for move in captures:
+            gs.staticExchange(move)
+    seeTime = time.perf_counter() - startTime
+
+    startTime = time.perf_counter()
+    for gs, captures in samples:
+        for move in captures:
+            gs.makeMove(move)
+            gs.getValidMoves()
+            gs.undoMove()
+    searchTime = time.perf_counter() - startTime
+
+    print("%d captures in %d positions" % (calls, len(samples)))
+    print("static exchange:        %8.1f us per capture (%.0f per second)" % (1e6 * seeTime / calls, calls / seeTime))
+    print("make, generate, undo:   %8.1f us per capture" % (1e6 * searchTime / calls))
+
+
+'''
+Seeks to random plies of a long random game: stepping with makeMove and undoMove from the ply shown, as the GUI did,
+against GameNavigator's checkpoints. Both work out the legal moves of the ply they land on.
+'''
+def benchSeek(plies=600, seeks=2000, seed=0):
+    random.seed(seed)
+    gs = ChessEngine.GameState()
+    for ply in range(plies):
+        validMoves = gs.getValidMoves()
+        if not validMoves:
+            break
+        gs.makeMove(random.choice(validMoves))
+    moves = list(gs.moveLog)
+    targets = [random.randint(0, len(moves)) for i in range(seeks)]
+
+    steps = 0
+    startTime = time.perf_counter()
+    for target in targets:
+        while len(gs.moveLog) > target:
+            gs.undoMove()
+            steps += 1
+        while len(gs.moveLog) < target:
+            gs.makeMove(moves[len(gs.moveLog)])
+            steps += 1
+        gs.getValidMoves()
+    stepTime = time.perf_counter() - startTime
+
+    gs.setFEN(ChessEngine.GameState().getFEN())
+    for move in moves:
+        gs.makeMove(move)
+    navigator = GameNavigator.GameNavigator(gs)
+    startTime = time.perf_counter()
+    for target in targets:
+        navigator.seek(target)
+        navigator.getValidMoves()
+    navigatorTime = time.perf_counter() - startTime
+
+    print("%d seeks in a game of %d plies" % (seeks, len(moves)))
+    print("make/undo steps:    %8.1f us per seek (%.1f steps)" % (1e6 * stepTime / seeks, steps / seeks))
+    print("checkpoints:        %8.1f us per seek (one every %d plies)" % (1e6 * navigatorTime / seeks,
+                                                                        navigator.checkpointInterval))
+
+'''
+Times the move generation of positions from random games: the moves of each type of piece without considering
+checks, per piece, then per position all of them, the pins and checks of the king and the legal moves
+'''
+def benchMoveGeneration(positions=300, repeats=5, seed=0):
+    random.seed(seed)
+    samples = []
+    for i in range(positions):
+        gs = ChessEngine.GameState()
+        for ply in range(random.randint(4, 80)):
+            validMoves = gs.getValidMoves()
+            if not validMoves:
+                break
+            gs.makeMove(random.choice(validMoves))
+        samples.append(gs)
+    print("%d positions" % len(samples))
+    for pieceType in "NKRBQp":
+        pieces = [(gs, r, c) for gs in samples for r in range(8) for c in range(8)
+                  if gs.board[r][c][1] == pieceType and (gs.board[r][c][0] == 'w') == gs.whiteToMove]
+        startTime = time.perf_counter()
+        for repeat in range(repeats):
+            for gs, r, c in pieces:
+                gs.moveFunctions[pieceType](r, c, [])
+        elapsed = (time.perf_counter() - startTime) / repeats
+        print("%-16s %10.2f us per piece" % (pieceType, 1e6 * elapsed / len(pieces)))
+    for name, function, count in (("all moves", ChessEngine.GameState.getAllPossibleMoves, repeats),
+                                  ("pins and checks", ChessEngine.GameState.checkForPinsAndChecks, repeats),
+                                  ("legal moves", ChessEngine.GameState.getValidMoves, 1)):
+        startTime = time.perf_counter()
+        for repeat in range(count):
+            for gs in samples:
+                function(gs)
+        elapsed = (time.perf_counter() - startTime) / count
+        print("%-16s %10.1f us per position" % (name, 1e6 * elapsed / len(samples)))
+
+'''
+Plays a move with every strength level in each of BENCH_POSITIONS, with a few seeds for the noise, and reports the
+node budget of the level, the mean nodes of a move, how many of the moves the budget stopped and the time a move takes:
+the mean, the 90th percentile and the worst
+'''
+def benchLevels(seeds=3):
+    print("%-14s %8s %8s %8s %10s %10s %10s" % ("level", "budget", "nodes", "stopped", "mean ms", "p90 ms", "max ms"))
+    for level in SmartMoveFinder.STRENGTH_LEVELS:
+        nodes = []
+        times = []
+        stopped = 0     #moves stopped by the node budget
+        for name, fen in BENCH_POSITIONS:
+            for seed in range(seeds):
+                gs = ChessEngine.GameState()
+                gs.setFEN(fen)
+                random.seed(seed)
+                with MatchRunner.engineConfig({"level": level}, SmartMoveFinder.PawnHashTable(),
+                                              SmartMoveFinder.TranspositionTable()):
+                    startTime = time.perf_counter()
+                    SmartMoveFinder.findBestMove(gs, gs.getValidMoves(), queue.Queue())
+                    times.append(time.perf_counter() - startTime)
+                    nodeLimit = SmartMoveFinder.NODE_LIMIT
+                    if SmartMoveFinder.searchStopped and nodeLimit is not None and SmartMoveFinder.counter >= nodeLimit:
+                        stopped += 1
+                nodes.append(SmartMoveFinder.counter)
+        times.sort()
+        print("%-14s %8s %8.0f %7.0f%% %10.1f %10.1f %10.1f" % (level, nodeLimit or "-", sum(nodes) / len(nodes),
+                                                               100 * stopped / len(nodes), 1000 * sum(times) / len(times),
+                                                               1000 * times[len(times) * 9 // 10], 1000 * times[-1]))
+
+'''
+Searches a position with findBestMove at the given depth and, if timeLimit is set, for at most that many seconds, with
+new hash tables and a fixed seed. Returns (gs, move, iterations, tables) where iterations are
+SmartMoveFinder.searchIterations and tables are the pawn hash table and the transposition table it used.
+'''
+def searchPosition(fen, depth, timeLimit=None, seed=0):
+    gs = ChessEngine.GameState()
+    gs.setFEN(fen)
+    random.seed(seed)
+    returnQueue = queue.Queue()
+    stopEvent = threading.Event()
+    timer = threading.Timer(timeLimit, stopEvent.set) if timeLimit else None
+    config = {"depth": depth, "time": timeLimit}
+    tables = (SmartMoveFinder.PawnHashTable(), SmartMoveFinder.TranspositionTable())
+    with MatchRunner.engineConfig(config, *tables):
+        if timer is not None:
+            timer.start()
+        try:
+            SmartMoveFinder.findBestMove(gs, gs.getValidMoves(), returnQueue, stopEvent)
+        finally:
+            if timer is not None:
+                timer.cancel()
+    return gs, returnQueue.get(), list(SmartMoveFinder.searchIterations), tables
+
+'''
+Reads an EPD file: a list of (FEN, {opcode: operand}) with the quotes taken off the operands
+'''
+def readEPD(path):
+    positions = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split(None, 4)
+            if len(fields) < 4 or line.startswith('#'):
+                continue
+            operations = {}
+            for operation in (fields[4] if len(fields) > 4 else "").split(';'):
+                operation = operation.strip()
+                if operation:
+                    opcode, operand = (operation.split(None, 1) + [""])[:2]
+                    operations[opcode] = operand.strip('"')
+            positions.append((" ".join(fields[:4]), operations))
+    return positions
+
+'''
+The speed part: nodes, seconds and the time each depth was reached for every position, and the totals
+'''
+def benchSearch(depth):
+    results = []
+    for name, fen in BENCH_POSITIONS:
+        gs, move, iterations, (pawnHashTable, transpositionTable) = searchPosition(fen, depth)
+        nodes = iterations[-1][3]
+        seconds = iterations[-1][4]
+        results.append({"name": name, "move": gs.getSAN(move), "nodes": nodes, "seconds": round(seconds, 4),
+                        "timeToDepth": [round(iteration[4], 4) for iteration in iterations],
+                        "pawnHashHitRate": round(pawnHashTable.hitRate(), 4),
+                        "transpositionHitRate": round(transpositionTable.hitRate(), 4)})
+        print("%-16s %-8s %8d nodes %8.2f s %8.0f nps   time to depth %s   hits: pawn %.0f%%, tt %.0f%%" % (
+              name, results[-1]["move"], nodes, seconds, nodes / seconds if seconds else 0,
+              " ".join("%.2f" % t for t in results[-1]["timeToDepth"]), 100 * pawnHashTable.hitRate(),
+              100 * transpositionTable.hitRate()))
+    nodes = sum(result["nodes"] for result in results)
+    seconds = sum(result["seconds"] for result in results)
+    timeToDepth = [round(sum(result["timeToDepth"][d] for result in results), 4) for d in range(depth)]
+    return {"depth": depth, "nodes": nodes, "seconds": round(seconds, 4), "nps": round(nodes / seconds) if seconds else 0,
+            "timeToDepth": timeToDepth, "positions": results}
+
+'''
+The tactics part: a position is solved when the move found is one of its "bm" moves. Its time to solve is when the
+first iteration that found it, and every one after it, was done.
+'''
+def benchTactics(path, depth, timeLimit):
+    results = []
+    for fen, operations in readEPD(path):
+        gs, move, iterations, tables = searchPosition(fen, depth, timeLimit)
+        bestMoves = []
+        for san in operations.get("bm", "").split():
+            try:
+                bestMoves.append(gs.parseSAN(san).moveID)
+            except ValueError:
+                print("%s: bm %s is not a legal move" % (operations.get("id", fen), san))
+        solved = move is not None and move.moveID in bestMoves
+        timeToSolve = None
+        if solved:
+            for iteration in iterations:
+                if all(later[1].moveID in bestMoves for later in iterations[iterations.index(iteration):]):
+                    timeToSolve = round(iteration[4], 4)
+                    break
+        results.append({"id": operations.get("id", fen), "move": gs.getSAN(move) if move else None, "solved": solved,
+                        "timeToSolve": timeToSolve})
+        print("%-30s %-8s %-10s %s" % (results[-1]["id"], results[-1]["move"], "solved" if solved else "NOT SOLVED",
+                                       "%.2f s" % timeToSolve if solved else ""))
+    solvedResults = [result for result in results if result["solved"]]
+    return {"depth": depth, "timeLimit": timeLimit, "solved": len(solvedResults), "total": len(results),
+            "timeToSolve": round(sum(result["timeToSolve"] for result in solvedResults), 4), "positions": results}
+
+'''
+Prints the numbers of a run next to a baseline run
+'''
+def compareResults(baseline, current):
+    rows = [("nodes", baseline["search"]["nodes"], current["search"]["nodes"]),
+            ("seconds", baseline["search"]["seconds"], current["search"]["seconds"]),
+            ("nodes per second", baseline["search"]["nps"], current["search"]["nps"])]
+    for d in range(min(len(baseline["search"]["timeToDepth"]), len(current["search"]["timeToDepth"]))):
+        rows.append(("time to depth %d" % (d + 1), baseline["search"]["timeToDepth"][d], current["search"]["timeToDepth"][d]))
+    rows.append(("tactics solved", baseline["tactics"]["solved"], current["tactics"]["solved"]))
+    rows.append(("time to solve", baseline["tactics"]["timeToSolve"], current["tactics"]["timeToSolve"]))
+    print("%-20s %12s %12s %9s" % ("", "baseline", "now", "change"))
+    for name, old, new in rows:
+        change = "%+.1f%%" % (100.0 * (new - old) / old) if old else ""
+        print("%-20s %12g %12g %9s" % (name, old, new, change))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Engine benchmarks")
+    parser.add_argument("command", choices=("see", "search", "seek", "levels", "movegen"))
+    parser.add_argument("--depth", type=int, default=2, help="search depth of the speed benchmark")
+    parser.add_argument("--tactics-depth", type=int, default=3)
+    parser.add_argument("--tactics-time", type=float, default=10.0, help="seconds per tactical position")
+    parser.add_argument("--epd", default=TACTICS_FILE, help="tactical positions with bm operations")
+    parser.add_argument("--save", metavar="FILE", help="write the results as json")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with the results saved in this file")
+    args = parser.parse_args(argv)
+    if args.command == "see":
+        correct = checkExchanges()
+        benchExchanges()
+        if not correct:
+            sys.exit(1)
+    elif args.command == "seek":
+        benchSeek()
+    elif args.command == "levels":
+        benchLevels()
+    elif args.command == "movegen":
+        benchMoveGeneration()
+    else:
+        results = {"search": benchSearch(args.depth),
+                   "tactics": benchTactics(args.epd, args.tactics_depth, args.tactics_time)}
+        print("%d nodes in %.2f s, %d nps; %d of %d tactics solved" % (results["search"]["nodes"],
+              results["search"]["seconds"], results["search"]["nps"], results["tactics"]["solved"],
+              results["tactics"]["total"]))
+        if args.baseline:
+            with open(args.baseline) as f:
+                compareResults(json.load(f), results)
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,124 @@
 This class is responsible for storing all the information about the current state of the chess game. Will also be responsible for determining the
 valid moves at the current state. It will also keep a move log.
 """
+import random
+import re
+
+'''
+Zobrist keys: one random 64 bit number for every piece on every square (indexed by row * 8 + col), for black to move,
+for each of the four castling rights and for the file of an en passant square. The key of a position is the xor of
+the keys that apply to it. The pawn key is the xor of the keys of all pawns on the board, so it only changes when the
+pawn structure changes.
+The keys are filled in by initZobristKeys when the first GameState is made, importing the module does not build them.
+'''
+ZOBRIST_SEED = 1923
+zobristPieceKeys = {}
+zobristCastleKeys = []  #wks, bks, wqs, bqs
+zobristEnpassantKeys = []   #by file
+zobristBlackToMoveKey = []  #a single key, kept in a list so it can be filled in place
+
+def initZobristKeys():
+    if not zobristPieceKeys:
+        zobristRandom = random.Random(ZOBRIST_SEED)
+        for piece in ('wp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bp', 'bR', 'bN', 'bB', 'bQ', 'bK'):
+            zobristPieceKeys[piece] = [zobristRandom.getrandbits(64) for sq in range(64)]
+        zobristCastleKeys.extend(zobristRandom.getrandbits(64) for i in range(4))
+        zobristEnpassantKeys.extend(zobristRandom.getrandbits(64) for c in range(8))
+        zobristBlackToMoveKey.append(zobristRandom.getrandbits(64))
+
+'''
+The zobrist key of the castling rights
+'''
+def castleRightsKey(rights):
+    key = 0
+    if rights.wks:
+        key ^= zobristCastleKeys[0]
+    if rights.bks:
+        key ^= zobristCastleKeys[1]
+    if rights.wqs:
+        key ^= zobristCastleKeys[2]
+    if rights.bqs:
+        key ^= zobristCastleKeys[3]
+    return key
+
+'''
+The zobrist key of the en passant square, which only counts when a pawn of the player to move can capture there
+'''
+def enpassantKey(board, enpassantPossible, whiteToMove):
+    if enpassantPossible == ():
+        return 0
+    r, c = enpassantPossible
+    pawnRow = r + 1 if whiteToMove else r - 1   #the row the capturing pawn stands on
+    capturingPawn = 'wp' if whiteToMove else 'bp'
+    if (c > 0 and board[pawnRow][c - 1] == capturingPawn) or (c < 7 and board[pawnRow][c + 1] == capturingPawn):
+        return zobristEnpassantKeys[c]
+    return 0
+
+'''
+Computes the full zobrist key of a position from scratch
+'''
+def computeZobristKey(gs):
+    initZobristKeys()
+    key = 0
+    for r in range(8):
+        for c in range(8):
+            if gs.board[r][c] != "--":
+                key ^= zobristPieceKeys[gs.board[r][c]][r * 8 + c]
+    if not gs.whiteToMove:
+        key ^= zobristBlackToMoveKey[0]
+    return key ^ castleRightsKey(gs.currentCastlingRight) ^ enpassantKey(gs.board, gs.enpassantPossible, gs.whiteToMove)
+
+'''
+Computes the pawn only zobrist key of a board from scratch
+'''
+def computePawnKey(board):
+    initZobristKeys()
+    key = 0
+    for r in range(8):
+        for c in range(8):
+            if board[r][c][1] == 'p':
+                key ^= zobristPieceKeys[board[r][c]][r * 8 + c]
+    return key
+
+'''
+Material values for the static exchange evaluation, and the order in which attackers are tried, cheapest first
+'''
+exchangeValues = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 0}
+attackerOrder = "pNBRQK"
+knightOffsets = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+kingOffsets = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+diagonalDirections = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+orthogonalDirections = ((-1, 0), (0, -1), (1, 0), (0, 1))
+
+'''
+Move tables, built once when the module is imported, indexed by [row][col] of the starting square: the squares a knight
+and a king reach from it, and for each of rayDirections the squares along that direction, nearest first, up to the
+edge of the board. The generators walk these lists instead of adding offsets and checking the bounds in every node.
+rayDirections has the four orthogonal directions first and the four diagonals after them.
+'''
+rayDirections = orthogonalDirections + diagonalDirections
+
+def squareTable(offsets):
+    return [[tuple((r + dr, c + dc) for dr, dc in offsets if 0 <= r + dr < 8 and 0 <= c + dc < 8) for c in range(8)]
+            for r in range(8)]
+
+def rayTable():
+    table = []
+    for r in range(8):
+        row = []
+        for c in range(8):
+            rays = []
+            for dr, dc in rayDirections:
+                rays.append(tuple((r + dr * i, c + dc * i) for i in range(1, 8)
+                                  if 0 <= r + dr * i < 8 and 0 <= c + dc * i < 8))
+            row.append(tuple(rays))
+        table.append(row)
+    return table
+
+knightSquares = squareTable(knightOffsets)
+kingSquares = squareTable(kingOffsets)
+raySquares = rayTable()
+
 class GameState():
     def __init__(self):    #building the structure
         #board is an eight by eight 2d list and each element of the list has 2 characters
@@ -32,6 +150,89 @@ class GameState():
         self.currentCastlingRight = CastleRights(True, True, True, True)
         self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
                                              self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
+        #pawn only zobrist key, used by the pawn hash table of the evaluation
+        self.pawnKey = computePawnKey(self.board)
+        self.pawnKeyLog = [self.pawnKey]
+        #zobrist key of the whole position, for the transposition table and the position index
+        self.zobristKey = computeZobristKey(self)
+        self.zobristKeyLog = [self.zobristKey]
+
+    '''
+    A GameState sent to another process (the AI) is unpickled without calling __init__, so make sure the zobrist keys
+    exist in that process as well
+    '''
+    def __setstate__(self, state):
+        initZobristKeys()
+        self.__dict__.update(state)
+
+    '''
+    Sets up the position of a FEN string. The move log starts empty from there. The halfmove clock and move number are
+    ignored.
+    '''
+    def setFEN(self, fen):
+        fields = fen.split()
+        board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["--"] * int(char))
+                elif char.lower() in "prnbqk":
+                    row.append(('w' if char.isupper() else 'b') + ('p' if char.lower() == 'p' else char.upper()))
+                else:
+                    raise ValueError("invalid FEN: " + fen)
+            board.append(row)
+        if len(board) != 8 or any(len(row) != 8 for row in board):
+            raise ValueError("invalid FEN: " + fen)
+        self.board = board
+        self.whiteToMove = len(fields) < 2 or fields[1] == 'w'
+        rights = fields[2] if len(fields) > 2 else '-'
+        self.currentCastlingRight = CastleRights('K' in rights, 'k' in rights, 'Q' in rights, 'q' in rights)
+        self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
+                                             self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
+        if len(fields) > 3 and fields[3] != '-':
+            self.enpassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        else:
+            self.enpassantPossible = ()
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == 'wK':
+                    self.whiteKingLocation = (r, c)
+                elif board[r][c] == 'bK':
+                    self.blackKingLocation = (r, c)
+        self.moveLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.pawnKey = computePawnKey(self.board)
+        self.pawnKeyLog = [self.pawnKey]
+        self.zobristKey = computeZobristKey(self)
+        self.zobristKeyLog = [self.zobristKey]
+
+    '''
+    The FEN string of the current position. The halfmove clock is not kept and always written as 0.
+    '''
+    def getFEN(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for square in row:
+                if square == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += square[1].upper() if square[0] == 'w' else square[1].lower()
+            ranks.append(rank + (str(empty) if empty else ""))
+        rights = self.currentCastlingRight
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + ("k" if rights.bks else "") + \
+                   ("q" if rights.bqs else "")
+        enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]] \
+            if self.enpassantPossible != () else "-"
+        return "%s %s %s %s 0 %d" % ("/".join(ranks), "w" if self.whiteToMove else "b", castling or "-", enpassant,
+                                     len(self.moveLog) // 2 + 1)
 
 
 
@@ -39,6 +240,7 @@ class GameState():
         Takes a move as a parameter and executes it (this will not work for castling, pawn promotion, and en-passant
         '''
     def makeMove(self, move):
+        oldKeyParts = castleRightsKey(self.currentCastlingRight) ^ enpassantKey(self.board, self.enpassantPossible, self.whiteToMove)
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move) #log the move so we can undo it later
@@ -51,7 +253,7 @@ class GameState():
 
         #pawn promotion
         if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionChoice
 
         #enpassantMove
         if move.isEnpassantMove:
@@ -76,9 +278,31 @@ class GameState():
         self.updateCastleRights(move)
         self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
                                              self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
+        #update the pawn key - only changes when a pawn moves or a pawn is captured
+        if move.pieceMoved[1] == 'p':
+            self.pawnKey ^= zobristPieceKeys[move.pieceMoved][move.startRow * 8 + move.startCol]
+            if not move.isPawnPromotion:  #a promoted pawn leaves the pawn structure
+                self.pawnKey ^= zobristPieceKeys[move.pieceMoved][move.endRow * 8 + move.endCol]
+        if move.pieceCaptured[1] == 'p':
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow  #enpassant captures beside the landing square
+            self.pawnKey ^= zobristPieceKeys[move.pieceCaptured][captureRow * 8 + move.endCol]
+        self.pawnKeyLog.append(self.pawnKey)
+        #update the zobrist key: the pieces that moved, the player to move, castling rights and en passant
+        key = self.zobristKey ^ zobristBlackToMoveKey[0] ^ oldKeyParts
+        key ^= zobristPieceKeys[move.pieceMoved][move.startRow * 8 + move.startCol]
+        key ^= zobristPieceKeys[self.board[move.endRow][move.endCol]][move.endRow * 8 + move.endCol]  #the promoted piece after a promotion
+        if move.isCapture:
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow
+            key ^= zobristPieceKeys[move.pieceCaptured][captureRow * 8 + move.endCol]
+        if move.isCastleMove:
+            rook = move.pieceMoved[0] + 'R'
+            rookFrom, rookTo = (7, 5) if move.endCol - move.startCol == 2 else (0, 3)
+            key ^= zobristPieceKeys[rook][move.endRow * 8 + rookFrom] ^ zobristPieceKeys[rook][move.endRow * 8 + rookTo]
+        self.zobristKey = key ^ castleRightsKey(self.currentCastlingRight) ^ enpassantKey(self.board, self.enpassantPossible, self.whiteToMove)
+        self.zobristKeyLog.append(self.zobristKey)
 
         '''
-        Undo the last move 
+        Undo the last move
         '''
     def undoMove(self):
         if len(self.moveLog) != 0:#making sure that there is a move to undo
@@ -99,6 +323,11 @@ class GameState():
             self.enpassantPossibleLog.pop()
             self.enpassantPossible = self.enpassantPossibleLog[-1]
 
+            self.pawnKeyLog.pop()
+            self.pawnKey = self.pawnKeyLog[-1]
+            self.zobristKeyLog.pop()
+            self.zobristKey = self.zobristKeyLog[-1]
+
             #undo castling Rights
             self.castleRightsLog.pop()  #gets rid of the one we just saved
             newRights = self.castleRightsLog[-1]
@@ -208,17 +437,205 @@ class GameState():
                 return True
         return False
 
+    '''
+    Whether a move without considering checks leaves the king of the player making it safe
+    '''
+    def isLegal(self, move):
+        self.makeMove(move)
+        self.whiteToMove = not self.whiteToMove
+        legal = not self.inCheck()
+        self.whiteToMove = not self.whiteToMove
+        self.undoMove()
+        return legal
+
+    '''
+    Static exchange evaluation of a move: the material the player making it wins (or loses, when negative) once all the
+    captures on its end square are played out, each side capturing with its least valuable attacker and free to stop
+    when going on would lose more. No moves are made, pieces that have captured are skipped over so the ones behind them
+    (a rook behind a queen, say) join in. Pins are not considered. A quiet move scores 0 or less, less when the piece
+    can be won on its new square.
+    '''
+    def staticExchange(self, move, values=exchangeValues):
+        targetValue = values[move.pieceCaptured[1]] if move.isCapture else 0
+        if move.isPawnPromotion:
+            targetValue += values[move.promotionChoice] - values['p']
+            attacker = move.pieceMoved[0] + move.promotionChoice
+        else:
+            attacker = move.pieceMoved
+        return self.exchangeOn(move.endRow, move.endCol, targetValue, attacker, {(move.startRow, move.startCol)}, values)
+
+    '''
+    Whether the piece (by default the one standing on r, c) would be safe on that square: the opponent cannot win
+    material by capturing it there. The piece has to be given for an empty square.
+    '''
+    def isSquareSafe(self, r, c, piece=None, values=exchangeValues):
+        piece = piece or self.board[r][c]
+        if piece == "--":
+            raise ValueError("no piece on %s%s to check the safety of" % (Move.colsToFiles[c], Move.rowsToRanks[r]))
+        enemyColor = 'b' if piece[0] == 'w' else 'w'
+        attacker = self.leastValuableAttacker(r, c, enemyColor, set())
+        if attacker is None:
+            return True
+        attackerRow, attackerCol, attackerPiece = attacker
+        return self.exchangeOn(r, c, values[piece[1]], attackerPiece, {(attackerRow, attackerCol)}, values) <= 0
+
+    '''
+    Plays out the captures on r, c after attacker took the piece worth targetValue there. removed holds the squares of
+    the pieces that have already captured. Returns the gain of the side of attacker.
+    '''
+    def exchangeOn(self, r, c, targetValue, attacker, removed, values):
+        gain = [targetValue]    #gain[d]: the material won by the side making capture d if the exchange stopped there
+        attackerValue = values[attacker[1]]
+        color = attacker[0]
+        while True:
+            color = 'b' if color == 'w' else 'w'
+            nextAttacker = self.leastValuableAttacker(r, c, color, removed)
+            if nextAttacker is None:
+                break
+            attackerRow, attackerCol, attacker = nextAttacker
+            removed.add((attackerRow, attackerCol))
+            if attacker[1] == 'K' and self.leastValuableAttacker(r, c, 'b' if color == 'w' else 'w', removed):
+                break   #the king cannot capture onto a square that is still defended
+            gain.append(attackerValue - gain[-1])
+            attackerValue = values[attacker[1]]
+        for d in range(len(gain) - 1, 0, -1):   #either side can stop capturing when it is better not to go on
+            gain[d - 1] = -max(-gain[d - 1], gain[d])
+        return gain[0]
+
+    '''
+    The least valuable piece of color attacking r, c, as (row, col, piece), treating the removed squares as empty.
+    None if there is no attacker.
+    '''
+    def leastValuableAttacker(self, r, c, color, removed):
+        board = self.board
+        pawnRow = r + 1 if color == 'w' else r - 1  #white pawns attack upwards
+        if 0 <= pawnRow < 8:
+            for pawnCol in (c - 1, c + 1):
+                if 0 <= pawnCol < 8 and board[pawnRow][pawnCol] == color + 'p' and (pawnRow, pawnCol) not in removed:
+                    return pawnRow, pawnCol, color + 'p'
+        for row, col in knightSquares[r][c]:
+            if board[row][col] == color + 'N' and (row, col) not in removed:
+                return row, col, color + 'N'
+        best = None
+        rays = raySquares[r][c]
+        for directions, sliders in ((rays[4:], 'BQ'), (rays[:4], 'RQ')):
+            for ray in directions:
+                for row, col in ray:
+                    square = board[row][col]
+                    if square != "--" and (row, col) not in removed:
+                        if square[0] == color and square[1] in sliders and \
+                                (best is None or attackerOrder.index(square[1]) < attackerOrder.index(best[2][1])):
+                            best = (row, col, square)
+                        break
+            if best is not None and best[2][1] == 'B':  #nothing cheaper than a bishop is left to find
+                return best
+        if best is not None:
+            return best
+        for row, col in kingSquares[r][c]:
+            if board[row][col] == color + 'K' and (row, col) not in removed:
+                return row, col, color + 'K'
+        return None
+
+    '''
+    All moves of one piece type ('p', 'R', 'N', 'B', 'Q' or 'K') of the current player without considering checks
+    '''
+    def getPieceMoves(self, pieceType):
+        moves = []
+        allyColor = "w" if self.whiteToMove else "b"
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c][0] == allyColor and self.board[r][c][1] == pieceType:
+                    self.moveFunctions[pieceType](r, c, moves)
+        return moves
+
+    '''
+    Standard algebraic notation of a move in the current position, before it is made. The starting file and/or rank is
+    added when another piece of the same type can legally reach the same square, and + or # when the move gives check
+    or mate. The notation is also stored on the move, so str(move) returns it from then on.
+    '''
+    def getSAN(self, move):
+        if move.isCastleMove:
+            san = "O-O" if move.endCol - move.startCol == 2 else "O-O-O"
+        else:
+            endSquare = move.getRankFile(move.endRow, move.endCol)
+            pieceType = move.pieceMoved[1]
+            if pieceType == 'p':
+                san = (move.colsToFiles[move.startCol] + 'x' if move.isCapture else '') + endSquare
+                if move.isPawnPromotion:
+                    san += '=' + move.promotionChoice
+            else:
+                rivals = [other for other in self.getPieceMoves(pieceType) if other.endRow == move.endRow and
+                          other.endCol == move.endCol and other.moveID != move.moveID]
+                rivals = [other for other in rivals if self.isLegal(other)]
+                san = pieceType
+                if rivals:  #two of the same type of piece moving to a square, Nbd2 if both knights can move to d2
+                    if all(other.startCol != move.startCol for other in rivals):
+                        san += move.colsToFiles[move.startCol]
+                    elif all(other.startRow != move.startRow for other in rivals):
+                        san += move.rowsToRanks[move.startRow]
+                    else:
+                        san += move.getRankFile(move.startRow, move.startCol)
+                san += ('x' if move.isCapture else '') + endSquare
+        #+ for a check and # for checkmate
+        checkMate, staleMate = self.checkMate, self.staleMate
+        self.makeMove(move)
+        if self.inCheck():
+            san += '+' if self.getValidMoves() else '#'
+        self.undoMove()
+        self.checkMate, self.staleMate = checkMate, staleMate
+        move.san = san
+        return san
+
+    '''
+    Finds the move written in standard algebraic notation in the current position. Check and annotation marks are
+    ignored. Only when more than one piece fits the notation are the candidates checked for legality, so this is cheap
+    enough to replay whole game databases, which are trusted to hold legal games: a single candidate that leaves the
+    king in check, or castling without the right to or through an attacked square, is accepted. Castling still needs
+    the king and the rook on their squares and nothing between them. With strict every move is checked for legality.
+    Raises ValueError for a move that is illegal (only the ones found illegal without strict), ambiguous or not SAN.
+    '''
+    def parseSAN(self, san, strict=False):
+        san = san.rstrip('+#!?')
+        if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+            row = 7 if self.whiteToMove else 0
+            color = 'w' if self.whiteToMove else 'b'
+            kingside = len(san) == 3
+            rookCol, between = (7, (5, 6)) if kingside else (0, (1, 2, 3))
+            if self.board[row][4] != color + 'K' or self.board[row][rookCol] != color + 'R' or \
+                    any(self.board[row][c] != '--' for c in between):
+                raise ValueError("illegal move: " + san)
+            move = Move((row, 4), (row, 6 if kingside else 2), self.board, isCastleMove=True)
+            if strict and move not in self.getValidMoves():
+                raise ValueError("illegal move: " + san)
+            return move
+        match = sanPattern.match(san)
+        if match is None:
+            raise ValueError("not a move in algebraic notation: " + san)
+        pieceType, fromFile, fromRank, endSquare, promotion = match.groups()
+        endRow = Move.ranksToRows[endSquare[1]]
+        endCol = Move.filesToCols[endSquare[0]]
+        candidates = [move for move in self.getPieceMoves(pieceType or 'p') if move.endRow == endRow and
+                      move.endCol == endCol and (fromFile is None or move.startCol == Move.filesToCols[fromFile]) and
+                      (fromRank is None or move.startRow == Move.ranksToRows[fromRank])]
+        if len(candidates) > 1 or strict:
+            candidates = [move for move in candidates if self.isLegal(move)]
+        if len(candidates) != 1:
+            raise ValueError(("ambiguous" if candidates else "illegal") + " move: " + san)
+        move = candidates[0]
+        if promotion is not None:
+            move.promotionChoice = promotion
+        return move
+
     '''
     All moves without considering checks.
     '''
     def getAllPossibleMoves(self):
         moves = []
-        for r in range(len(self.board)):   #number of rows
-            for c in range(len(self.board[r])):  #number of cols in the given row
-                turn = self.board[r][c][0]
-                if(turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):  #to find the bugs print any random statement
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves)  #calls the appropriate move function based on piece types
+        allyColor = 'w' if self.whiteToMove else 'b'
+        for r, row in enumerate(self.board):
+            for c, square in enumerate(row):
+                if square[0] == allyColor:
+                    self.moveFunctions[square[1]](r, c, moves)  #calls the appropriate move function based on piece types
         return moves
     '''
         Get all the pawn moves for the pawn located at row, col and add these moves to thee list
@@ -298,24 +715,7 @@ class GameState():
                     self.pins.remove(self.pins[i])
                 break
                 '''
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))   #up, left, down right
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8: #on board
-                    #if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):  #the piece should be able to move towards the pin and away from the pin
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--": #empty space valid
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor: #enemy Piece valid
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break
-                    else: #friendly piece invalid
-                        break
-                else:  #off board
-                    break
+        self.getSlidingMoves(r, c, raySquares[r][c][:4], moves)   #up, left, down right
         '''
             Get all the knight moves for the rook located at row, col and add these moves to the list
         '''
@@ -329,66 +729,53 @@ class GameState():
                 self.pins.remove(self.pins[i])
                 break
                 '''
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
         allyColor = "w" if self.whiteToMove else "b"
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                '''if not piecePinned:'''
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:  #not an ally piece (empty or enemy piece)
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
+        board = self.board
+        for endSq in knightSquares[r][c]:
+            if board[endSq[0]][endSq[1]][0] != allyColor:  #not an ally piece (empty or enemy piece)
+                moves.append(Move((r, c), endSq, board))
 
     '''
     Get all the bishop moves for the rook located at row, col and add these moves to the list
     '''
 
     def getBishopMoves(self, r, c, moves):
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))  #4 diagonals
+        self.getSlidingMoves(r, c, raySquares[r][c][4:], moves)   #4 diagonals
+
+    '''
+    The moves of a rook, bishop or queen at r, c along the given rays: every empty square up to the first piece, and
+    that square too when the piece is an enemy's
+    '''
+    def getSlidingMoves(self, r, c, rays, moves):
         enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):  #bishop can move max of 7 squares
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:  #is it on the board
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--":  # empty Piece valid
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor: #enemy piece valid
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break
-                    else:  #friendly piece invalid
-                        break
-                else:  # off board
+        board = self.board
+        startSq = (r, c)
+        for ray in rays:
+            for endSq in ray:
+                endPiece = board[endSq[0]][endSq[1]]
+                if endPiece == "--":  #empty space valid
+                    moves.append(Move(startSq, endSq, board))
+                else:
+                    if endPiece[0] == enemyColor:  #enemy piece valid, friendly piece invalid
+                        moves.append(Move(startSq, endSq, board))
                     break
         '''
             Get all the queen moves for the rook located at row, col and add these moves to the list
         '''
 
     def getQueenMoves(self, r, c, moves):
-        self.getRookMoves(r, c, moves)
-        self.getBishopMoves(r, c, moves)
+        self.getSlidingMoves(r, c, raySquares[r][c], moves)  #the rook's directions, then the bishop's
 
     '''
         Get all the king moves for the rook located at row, col and add these moves to the list
     '''
 
     def getKingMoves(self, r, c, moves):
-        kingMoves = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
         allyColor = "w" if self.whiteToMove else "b"
-        for i in range(8):
-            endRow = r + kingMoves[i][0]
-            endCol = c + kingMoves[i][1]
-            '''
-            for i in range(8):
-                endRow = r + kingMoves[i][0]
-                endCol = c + kingMoves[i][1]
-                '''
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:  # not an ally piece (empty or enemy piece)
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
+        board = self.board
+        for endSq in kingSquares[r][c]:
+            if board[endSq[0]][endSq[1]][0] != allyColor:  # not an ally piece (empty or enemy piece)
+                moves.append(Move((r, c), endSq, board))
 
     '''
     Generate all the valid Castling Moves for the king at (r, c) and add them to the list of moves
@@ -432,53 +819,44 @@ class GameState():
             startRow = self.blackKingLocation[0]
             startCol = self.blackKingLocation[1]
         # check outward from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
+        rays = raySquares[startRow][startCol]
+        for j in range(8):
+            d = rayDirections[j]
             possiblePin = ()  # reset possible pins
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != 'K':
-                        if possiblePin == ():  # 1st allied piece could be pinned
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        else:  # 2nd allied piece, so no pin or check is possible in this direction
+            for i, (endRow, endCol) in enumerate(rays[j], 1):
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == allyColor and endPiece[1] != 'K':
+                    if possiblePin == ():  # 1st allied piece could be pinned
+                        possiblePin = (endRow, endCol, d[0], d[1])
+                    else:  # 2nd allied piece, so no pin or check is possible in this direction
+                        break
+                elif endPiece[0] == enemyColor:
+                    type = endPiece[1]
+                    # 5 possibilities here in this complex conditional
+                    # 1. orthogoinally away from king and piece is a rook
+                    # 2. diagonally away from king and piece is a bishop
+                    # 3. 1 square away diagonally from the king and piece is a pawn
+                    # 4. any direction and piece is a queen
+                    # 5, any direction 1 square away and piece is king ( this is necessary to prevent a king move to a square controlled by another king
+                    if (0 <= j <= 3 and type == 'R') or \
+                            (4 <= j <= 7 and type == 'B') or \
+                            (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
+                            (type == 'Q') or (i == 1 and type == 'K'):
+                        if possiblePin == ():  # no piece blocking, so check
+                            inCheck = True
+                            checks.append((endRow, endCol, d[0], d[1]))
                             break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        # 5 possibilities here in this complex conditional
-                        # 1. orthogoinally away from king and piece is a rook
-                        # 2. diagonally away from king and piece is a bishop
-                        # 3. 1 square away diagonally from the king and piece is a pawn
-                        # 4. any direction and piece is a queen
-                        # 5, any direction 1 square away and piece is king ( this is necessary to prevent a king move to a square controlled by another king
-                        if (0 <= j <= 3 and type == 'R') or \
-                                (4 <= j <= 7 and type == 'B') or \
-                                (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
-                                (type == 'Q') or (i == 1 and type == 'K'):
-                            if possiblePin == ():  # no piece blocking, so check
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else:  # piece blocking so pin
-                                pins.append(possiblePin)
-                                break
-                        else:  # enemy piece not applying check
+                        else:  # piece blocking so pin
+                            pins.append(possiblePin)
                             break
-                else:
-                    break  # off board
+                    else:  # enemy piece not applying check
+                        break
         #check for knight checks
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (2, -1), (2, 1))
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0]  == enemyColor and endPiece[1] == 'N':  #enemy knight attacking king
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
+        for endRow, endCol in knightSquares[startRow][startCol]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece[0] == enemyColor and endPiece[1] == 'N':  #enemy knight attacking king
+                inCheck = True
+                checks.append((endRow, endCol, endRow - startRow, endCol - startCol))
         return inCheck, pins, checks
 
     def updateCastleRights(self, move):
@@ -523,7 +901,15 @@ class CastleRights():
         self.wqs = wqs
         self.bqs = bqs
 
+'''
+piece letter, starting file, starting rank, end square and promotion piece of a move in algebraic notation
+'''
+sanPattern = re.compile(r"^([KQRBN])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBN]))?$")
+
 class Move():
+    promotionChoice = 'Q'   #the piece a pawn promotes to, only set on a move when it is not a queen
+    san = None  #standard algebraic notation, filled in by GameState.getSAN
+
     # maps keys to values
     # keys:values
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
@@ -569,6 +955,8 @@ class Move():
 
     #overriding the string function
     def __str__(self):
+        if self.san is not None:
+            return self.san
         #castle move
         if self.isCastleMove:
             return "O-O" if self.endCol == 6  else "O-O-O" #kingside castle
@@ -2,9 +2,13 @@
 This is our main driver file. It will be responsible for handling user input and displaying the current GameState(class) object.
 """
 
-import pygame as p
-from Chess import ChessEngine, SmartMoveFinder
-from multiprocessing import Process, Queue
+import os
+from Chess import AnalysisCache, ChessEngine, GameNavigator, SmartMoveFinder
+from multiprocessing import Array, Event, Process, Queue
+
+#pygame is imported by main(). The AI runs in a separate process, and where processes are spawned (Windows, macOS)
+#that process imports this module again, it should not pay for loading pygame on every move
+p = None
 
 BOARD_WIDTH = BOARD_HEIGHT = 512 # alternative to be 400
 MOVE_LOG_PANEL_WIDTH = 250
@@ -12,31 +16,59 @@ MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8  #dimesions of the board being 8 x 8
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 15  #for animations later on
+ANIMATION_DURATION = 0.15   #seconds a move animation takes, whatever the distance the piece travels
+ANIMATION_FPS = 60
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+PIECES = ['wp', 'wR', 'wN', 'wB', 'wK', 'wQ', 'bp', 'bR', 'bN', 'bB', 'bK', 'bQ']
 IMAGES = {}
+SPRITE_ATLASES = {}  #square size -> one surface holding all the scaled pieces side by side
+FONTS = {}
 
 '''
 Initialize a global dictionary of images. This will be called exactly once in the main.
+The pieces are loaded and scaled once per square size into an atlas, IMAGES holds views into the atlas.
 '''
-def loadImages():
-    pieces = ['wp', 'wR', 'wN', 'wB', 'wK', 'wQ', 'bp', 'bR', 'bN', 'bB', 'bK', 'bQ']
-    for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
+def loadImages(sqSize=SQ_SIZE):
+    if sqSize not in SPRITE_ATLASES:
+        atlas = p.Surface((sqSize * len(PIECES), sqSize), p.SRCALPHA).convert_alpha()
+        for i in range(len(PIECES)):
+            image = p.image.load(os.path.join(IMAGES_DIR, PIECES[i] + ".png"))
+            atlas.blit(p.transform.scale(image.convert_alpha(), (sqSize, sqSize)), (i * sqSize, 0))
+        SPRITE_ATLASES[sqSize] = atlas
+    atlas = SPRITE_ATLASES[sqSize]
+    for i in range(len(PIECES)):
+        IMAGES[PIECES[i]] = atlas.subsurface(p.Rect(i * sqSize, 0, sqSize, sqSize))
     #Note: we can access an image by using 'IMAGES['wp']'
 
+'''
+Fonts are looked up once and reused
+'''
+def getFont(name, size, bold=False, italic=False):
+    key = (name, size, bold, italic)
+    if key not in FONTS:
+        FONTS[key] = p.font.SysFont(name, size, bold, italic)
+    return FONTS[key]
+
 '''
 THE MAIN driver for our code. This will handle user input and updating the graphics
 '''
 def main():
+    global p
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    import pygame as p
     p.init()
     screen = p.display.set_mode((BOARD_WIDTH + MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    moveLogFont = p.font.SysFont("Arial", 14, False, False)
-    gs = ChessEngine.GameState()
-    validMoves = gs.getValidMoves()
+    loadImages()    #only do this once, before the while loop
+    analysisCache = AnalysisCache.AnalysisCache()   #positions analysed before are not searched again
+    moveLogFont = getFont("Arial", 14)
+    renderCache = RenderCache(moveLogFont)
+    navigator = GameNavigator.GameNavigator()   #the game line, the arrow keys move through it
+    gs = navigator.gs
+    validMoves = navigator.getValidMoves()
     moveMade = False  #flag variable for when a move is made
     animate = False #flag variable for when when we should animate a move
-    loadImages()    #only do this once, before the while loop
     running = True
     sqSelected = ()  #makes this a tuple no square is selected initially(tuple: (row,col)
     playerClicks = []  #keep track of the player clicks (two tuples: [(6,4),(4,4)]
@@ -45,7 +77,12 @@ def main():
     playerTwo = False  #same as above but for black
     AIThinking = False
     moveFinderProcess = None
+    stopEvent = None    #set to stop the AI, it then answers with the best move it has found so far
+    resultSlot = None   #[moveID, score, depth] of the AI's last completed iteration
+    forceMove = False
     moveUndone = False
+    levels = list(SmartMoveFinder.STRENGTH_LEVELS)
+    level = None    #the AI searches to SmartMoveFinder.DEPTH until a strength level is picked with 'l'
     while running:
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
         for e in p.event.get():
@@ -68,7 +105,8 @@ def main():
                         print(move.getChessNotation())
                         for i in range(len(validMoves)):
                             if move == validMoves[i]:
-                                gs.makeMove(validMoves[i])
+                                gs.getSAN(validMoves[i])    #for the move log, has to be worked out before the move is made
+                                navigator.makeMove(validMoves[i])   #a move at an earlier ply replaces the rest of the line
                                 moveMade = True
                                 animate = True
                                 sqSelected = () #reset user clicks
@@ -78,73 +116,191 @@ def main():
             #key handlers
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z: #undo when 'z' is pressed
-                    gs.undoMove()
+                    navigator.undoMove()
                     moveMade = True
                     animate = False     #here animate is a flag variable
                     gameOver = False
                     if AIThinking:
-                        moveFinderProcess.terminate()
+                        stopEvent.set()     #the search stops within a few nodes, its answer is not needed any more
                         AIThinking = False
+                    forceMove = False
                     moveUndone = True
                 if e.key == p.K_r:  #reset the board when 'r' is pressed
-                    gs = ChessEngine.GameState()
-                    validMoves = gs.getValidMoves()
+                    navigator = GameNavigator.GameNavigator()
+                    gs = navigator.gs
+                    validMoves = navigator.getValidMoves()
                     sqSelected = ()
                     playerClicks = []
                     moveMade = False
                     animate = False
                     gameOver = False
                     if AIThinking:
-                        moveFinderProcess.terminate()
+                        stopEvent.set()
                         AIThinking = False
+                    forceMove = False
+                    moveUndone = True
+                if e.key == p.K_f and AIThinking:  #force the AI to play its best move so far when 'f' is pressed
+                    forceMove = True
+                if e.key == p.K_l:  #the next strength level, for the AI's next move
+                    level = levels[(levels.index(level) + 1) % len(levels)] if level in levels else levels[0]
+                    print("level: " + level)
+                if e.key in (p.K_LEFT, p.K_RIGHT, p.K_HOME, p.K_END):  #move through the game without changing it
+                    target = {p.K_LEFT: navigator.ply - 1, p.K_RIGHT: navigator.ply + 1, p.K_HOME: 0,
+                              p.K_END: len(navigator)}[e.key]
+                    navigator.seek(target)
+                    moveMade = True
+                    animate = False
+                    gameOver = False
+                    if AIThinking:
+                        stopEvent.set()
+                        AIThinking = False
+                    forceMove = False
                     moveUndone = True
 
 
         #AI move finder logic
-        if not gameOver and not humanTurn and not moveUndone:
+        if not gameOver and not humanTurn and not moveUndone and navigator.atEnd():  #the AI waits while looking back
             if not AIThinking:
                 AIThinking = True
                 print("thinking...")
                 returnQueue = Queue()   #used to pass the data between threads
-                moveFinderProcess = Process(target=SmartMoveFinder.findBestMove, args= (gs, validMoves, returnQueue))
-                moveFinderProcess.start() #call findBestMove(gs, validMoves, returnQueue)
+                stopEvent = Event()
+                resultSlot = Array('d', [-1, 0, 0])
+                moveFinderProcess = Process(target=findAIMove, args= (gs, validMoves, returnQueue, stopEvent, resultSlot, analysisCache, level))
+                moveFinderProcess.start() #call findAIMove(gs, validMoves, returnQueue, stopEvent, resultSlot, analysisCache, level)
 
-            if not moveFinderProcess.is_alive():
+            if forceMove:
+                print("forced to move")
+                stopEvent.set()
+                AIMove = bestMoveSoFar(resultSlot, validMoves)
+                if AIMove is None:  #no iteration finished yet, the stopped search answers within a few nodes
+                    AIMove = returnQueue.get()
+            elif not moveFinderProcess.is_alive():
                 print("done thinking")
                 AIMove = returnQueue.get()
+            else:
+                AIMove = ()     #still thinking
+            if AIMove != ():
                 if AIMove is None:
                     AIMove = SmartMoveFinder.findRandomMove(validMoves)
-                gs.makeMove(AIMove)
+                gs.getSAN(AIMove)
+                navigator.makeMove(AIMove)
                 moveMade = True
                 animate = True
                 AIThinking = False
+                forceMove = False
 
 
         if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)    #we are animating the last move in the movelog, on the screen with the board using pygame clock
-            validMoves = gs.getValidMoves()
+                animateMove(gs.moveLog[-1], screen, gs.board, clock, renderCache)    #we are animating the last move in the movelog, on the screen with the board using pygame clock
+            validMoves = navigator.getValidMoves()  #only for the ply shown, however many keys were pressed this frame
             moveMade = False
             animate = False
             moveUndone = False
 
-        drawGameState(screen, gs, validMoves, sqSelected, moveLogFont)
+        endGameText = None
         if gs.checkMate or gs.staleMate:
             gameOver = True
-            text = 'Stalemate' if gs.staleMate else 'Black wins by Checkmate' if gs.whiteToMove else 'White wins by Checkmate'
-            drawEndGameText(screen, text)
+            endGameText = 'Stalemate' if gs.staleMate else 'Black wins by Checkmate' if gs.whiteToMove else 'White wins by Checkmate'
+        dirtyRects = drawGameState(screen, gs, validMoves, sqSelected, renderCache, endGameText)
 
         clock.tick(MAX_FPS)
-        p.display.flip()
+        if dirtyRects:  #only push the parts of the screen that changed, an idle frame pushes nothing
+            p.display.update(dirtyRects)
 
 '''
-Responsible for all graphics within a current GameState
+Runs in the AI process. The settings of the search are passed in and set there, a spawned process does not see the
+globals the GUI set in its own copy of SmartMoveFinder
 '''
-def drawGameState(screen, gs, validMoves, sqSelected, moveLogFont):
-    drawBoard(screen)  #draw squares on the board
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces(screen, gs.board)  #draw pieces on top of those squares
-    drawMoveLog(screen, gs, moveLogFont)
+def findAIMove(gs, validMoves, returnQueue, stopEvent, resultSlot, analysisCache, level=None):
+    SmartMoveFinder.analysisCache = analysisCache
+    if level is not None:
+        SmartMoveFinder.setStrength(level)
+    SmartMoveFinder.findBestMove(gs, validMoves, returnQueue, stopEvent, resultSlot)
+
+'''
+The move the AI published in the result slot after its last completed iteration, None if there is none yet
+'''
+def bestMoveSoFar(resultSlot, validMoves):
+    with resultSlot.get_lock():
+        moveID = int(resultSlot[0])
+    for move in validMoves:
+        if move.moveID == moveID:
+            return move
+    return None
+
+'''
+Keeps what is currently on the screen so that a frame only redraws what changed: a pre-rendered board without pieces,
+the (piece, highlight) of every square as last drawn and the rendered lines of the move log.
+'''
+class RenderCache():
+    def __init__(self, moveLogFont):
+        self.boardSurface = p.Surface((BOARD_WIDTH, BOARD_HEIGHT)).convert()
+        drawBoard(self.boardSurface)
+        self.highlightSurfaces = {}
+        for color in ('blue', 'yellow'):
+            s = p.Surface((SQ_SIZE, SQ_SIZE))
+            s.set_alpha(100)  #transparency value, -> 0 transparent, 255 opaque
+            s.fill(p.Color(color))
+            self.highlightSurfaces[color] = s
+        self.squares = None  #None forces a redraw of the whole board
+        self.endGameText = None
+        self.moveLogFont = moveLogFont
+        self.moveLogMoves = []  #the moves the cached move texts were made from
+        self.moveTexts = []
+        self.moveLogLines = []  #(text, rendered surface) for every line of the move log
+        self.moveLogDirty = True
+
+    '''
+    Brings the move texts up to date with the move log, only the moves after the first difference are converted again
+    and only the lines whose text changed are rendered again. Returns True if anything changed.
+    '''
+    def updateMoveLog(self, moveLog):
+        first = 0
+        while first < len(moveLog) and first < len(self.moveLogMoves) and moveLog[first] is self.moveLogMoves[first]:
+            first += 1
+        if first == len(moveLog) == len(self.moveLogMoves) and not self.moveLogDirty:
+            return False
+        del self.moveLogMoves[first:]
+        del self.moveTexts[first:]
+        for move in moveLog[first:]:
+            self.moveLogMoves.append(move)
+            self.moveTexts.append(str(move))
+
+        lines = moveLogLines(self.moveTexts)
+        del self.moveLogLines[len(lines):]
+        for i in range(len(lines)):
+            if i == len(self.moveLogLines) or self.moveLogLines[i][0] != lines[i]:
+                line = (lines[i], self.moveLogFont.render(lines[i], True, p.Color('white')))
+                if i == len(self.moveLogLines):
+                    self.moveLogLines.append(line)
+                else:
+                    self.moveLogLines[i] = line
+        self.moveLogDirty = False
+        return True
+
+'''
+Responsible for all graphics within a current GameState. Only the squares whose piece or highlight changed since the
+last frame and the move log (when it changed) are drawn again. Returns the rectangles of the screen that were drawn.
+'''
+def drawGameState(screen, gs, validMoves, sqSelected, renderCache, endGameText=None):
+    dirtyRects = []
+    if endGameText != renderCache.endGameText:  #the text covers the middle of the board, redraw all of it
+        renderCache.squares = None
+        renderCache.endGameText = endGameText
+    squares = squareStates(gs, validMoves, sqSelected)
+    for r in range(DIMENSION):
+        for c in range(DIMENSION):
+            if renderCache.squares is None or renderCache.squares[r][c] != squares[r][c]:
+                dirtyRects.append(drawSquare(screen, r, c, squares[r][c], renderCache))
+    renderCache.squares = squares
+    if dirtyRects and endGameText is not None:
+        dirtyRects.append(drawEndGameText(screen, endGameText))
+    moveLogRect = drawMoveLog(screen, gs, renderCache)
+    if moveLogRect is not None:
+        dirtyRects.append(moveLogRect)
+    return dirtyRects
 
 '''
 Draw squares on the board. The top left square is always light
@@ -161,23 +317,31 @@ def drawBoard(screen):
             #the dark squares are off parity and white squares are even parity
 
 '''
-Highlights the square selected and moves for piece selected
+The piece and the highlight of every square: blue for the square selected and yellow for the moves of the piece selected
 '''
-def highlightSquares(screen, gs, validMoves, sqSelected):
+def squareStates(gs, validMoves, sqSelected):
+    highlights = {}
     if sqSelected != ():
         r, c = sqSelected
         if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):   #sqSelected is a piece hat can be moved
-            #highlight selected square
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)  #transparency value, -> 0 transparent, 255 opaque
-            s.fill(p.Color('blue'))
-            screen.blit(s, (c*SQ_SIZE, r*SQ_SIZE))
-            #highlight moves from the square
-            s.fill(p.Color('yellow'))
+            highlights[(r, c)] = 'blue'
             for move in validMoves:
                 if move.startRow == r and move.startCol == c:
-                    screen.blit(s, (move.endCol*SQ_SIZE, move.endRow*SQ_SIZE))
+                    highlights[(move.endRow, move.endCol)] = 'yellow'
+    return [[(gs.board[r][c], highlights.get((r, c))) for c in range(DIMENSION)] for r in range(DIMENSION)]
 
+'''
+Draws one square from the cached board, then its highlight and its piece
+'''
+def drawSquare(screen, r, c, state, renderCache):
+    piece, highlight = state
+    square = p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    screen.blit(renderCache.boardSurface, square, square)
+    if highlight is not None:
+        screen.blit(renderCache.highlightSurfaces[highlight], square)
+    if piece != "--":  #not empty square
+        screen.blit(IMAGES[piece], square)
+    return square
 
 '''
 Draw the pieces on the board using the current gamestate.board
@@ -188,69 +352,88 @@ def drawPieces(screen, board):
             piece = board[r][c]
             if piece != "--":  #not empty square
                 screen.blit(IMAGES[piece], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+
 '''
-Draw the move Log
+Groups the move texts into the lines of the move log
 '''
-def drawMoveLog(screen, gs, font):
-    moveLogRect = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)  # a rectangel object
-    p.draw.rect(screen, p.Color("black"), moveLogRect)
-    moveLog = gs.moveLog
-    moveTexts = []
-    for i in range(0, len(moveLog), 2):
-        moveString = str(i//2 + 1) + ". " + str(moveLog[i]) + " "
-        if i + 1 < len(moveLog):    #make sure black made a move
-            moveString += str(moveLog[i+1]) + "  "
-        moveTexts.append(moveString)
+def moveLogLines(moveTexts):
+    pairTexts = []
+    for i in range(0, len(moveTexts), 2):
+        moveString = str(i//2 + 1) + ". " + moveTexts[i] + " "
+        if i + 1 < len(moveTexts):    #make sure black made a move
+            moveString += moveTexts[i+1] + "  "
+        pairTexts.append(moveString)
     #1. e2e4 e4e5 2.
 
     movesPerRow = 3
+    lines = []
+    for i in range(0, len(pairTexts), movesPerRow):
+        lines.append("".join(pairTexts[i:i + movesPerRow]))     #does three moves altogether
+    return lines
+
+'''
+Draw the move Log, only when it changed. Returns the rectangle drawn or None
+'''
+def drawMoveLog(screen, gs, renderCache):
+    if not renderCache.updateMoveLog(gs.moveLog):
+        return None
+    moveLogRect = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)  # a rectangel object
+    p.draw.rect(screen, p.Color("black"), moveLogRect)
     padding = 5
     textY = padding
     lineSpacing = 2 #in pixels
-    for i in range(0, len(moveTexts), movesPerRow):
-        text = ""
-        for j in range(movesPerRow):
-            if i + j < len(moveTexts):
-                text += moveTexts[i + j]        #does three moves altogether
-        textObject = font.render(text, True, p.Color('white'))
+    for text, textObject in renderCache.moveLogLines:
         textLocation = moveLogRect.move(padding, textY)
         screen.blit(textObject, textLocation)
         textY += textObject.get_height() + lineSpacing
+    return moveLogRect
 
 
 '''
 Animating a move
 '''
-def animateMove(move, screen, board, clock):
-    coords = []  #list of coordinates that the animation will move through
+def animateMove(move, screen, board, clock, renderCache):
     dR = move.endRow - move.startRow
     dC = move.endCol - move.startCol
-    framesPerSquare = 10 #frames to move one square
-    frameCount = (abs(dR) + abs(dC)) * framesPerSquare
-    for frame in range(frameCount + 1):
+    #the board after the move without the moving piece is drawn once, every frame only repairs the part of it under
+    #the piece in its last position and draws the piece in its new one
+    background = renderCache.boardSurface.copy()
+    drawPieces(background, board)
+    endSquare = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)   #is a pygame object, sqsize is the length
+    background.blit(renderCache.boardSurface, endSquare, endSquare)  #erase the pieceMoved from its ending square
+    #draw captured piece back where it stood
+    if move.pieceCaptured != '--':
+        captureRow = move.startRow if move.isEnpassantMove else move.endRow
+        background.blit(IMAGES[move.pieceCaptured], p.Rect(move.endCol*SQ_SIZE, captureRow*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    boardRect = p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT)
+    screen.blit(background, boardRect)
+    p.display.update(boardRect)
+
+    frameCount = max(1, round(ANIMATION_DURATION * ANIMATION_FPS))   #the same time for every move, however far it goes
+    lastRect = p.Rect(move.startCol*SQ_SIZE, move.startRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    for frame in range(1, frameCount + 1):
         r, c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        #erase the pieceMoved from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)   #is a pygame object, sqsize is the length
-        p.draw.rect(screen, color, endSquare)
-        #draw captured piece onto rectangle
-        if move.pieceCaptured != '--':
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-        #draw moving piece
-        if move.pieceMoved != '--':
-            screen.blit(IMAGES[move.pieceMoved], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
-        clock.tick(60)
+        pieceRect = p.Rect(round(c*SQ_SIZE), round(r*SQ_SIZE), SQ_SIZE, SQ_SIZE)
+        screen.blit(background, lastRect, lastRect)
+        screen.blit(IMAGES[move.pieceMoved], pieceRect)
+        p.display.update([lastRect, pieceRect])
+        lastRect = pieceRect
+        clock.tick(ANIMATION_FPS)
+
+    #the screen now shows the board without highlights, except for the ending square where the captured piece was drawn
+    renderCache.squares = [[(board[r][c], None) for c in range(DIMENSION)] for r in range(DIMENSION)]
+    renderCache.squares[move.endRow][move.endCol] = None
+    if move.isEnpassantMove:
+        renderCache.squares[move.startRow][move.endCol] = None
 
 def drawEndGameText(screen, text):
-    font = p.font.SysFont("Helvitca", 32, True, False)
+    font = getFont("Helvitca", 32, True)
     textObject = font.render(text, 0, p.Color('Gray'))
     textLocation = p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT).move(BOARD_WIDTH / 2 - textObject.get_width() / 2, BOARD_HEIGHT / 2 - textObject.get_height() / 2)
     screen.blit(textObject, textLocation)
     textObject = font.render(text, 0, p.Color('Black'))
     screen.blit(textObject, textLocation.move(2, 2))
+    return p.Rect(textLocation.x, textLocation.y, textObject.get_width() + 2, textObject.get_height() + 2)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,154 @@
+"""
+Moving through a game: the game line is kept as a list of moves, and every CHECKPOINT_INTERVAL plies the position is
+saved in a compact checkpoint (the board and the king squares). Seeking to a ply restores the nearest checkpoint and
+makes or undoes the moves from there, so it costs at most CHECKPOINT_INTERVAL / 2 make/undo steps whatever the length
+of the game, instead of one step per ply in between.
+
+The castling rights, en passant squares and zobrist keys of every ply are small and kept for the whole line, so a
+restored GameState has its full move log and logs, and undoMove works on it as usual. The legal moves and the
+evaluation are only worked out for the ply that is asked for, and remembered until the line changes.
+
+Usage:
+    navigator = GameNavigator.GameNavigator()
+    navigator.makeMove(move)    #plays a move at the current ply, a move played at an earlier ply replaces the rest
+    navigator.seek(10)          #navigator.gs is now the position after the tenth ply
+    navigator.getValidMoves()
+"""
+from Chess import ChessEngine, SmartMoveFinder
+
+CHECKPOINT_INTERVAL = 16    #plies between two checkpoints
+
+
+class GameNavigator():
+    def __init__(self, gs=None, checkpointInterval=CHECKPOINT_INTERVAL):
+        self.gs = gs if gs is not None else ChessEngine.GameState()
+        self.checkpointInterval = checkpointInterval
+        self.moves = list(self.gs.moveLog)  #the whole line, the moves after ply are the ones seek can go forward to
+        self.ply = len(self.moves)
+        #(enpassantPossible, castling rights, pawnKey, zobristKey) after every ply of the line, the logs of the GameState
+        rights = self.gs.castleRightsLog
+        self.history = [(self.gs.enpassantPossibleLog[i], (rights[i].wks, rights[i].bks, rights[i].wqs, rights[i].bqs),
+                         self.gs.pawnKeyLog[i], self.gs.zobristKeyLog[i]) for i in range(self.ply + 1)]
+        self.checkpoints = {}   #ply -> (board, whiteToMove, whiteKingLocation, blackKingLocation)
+        self.validMoves = {}    #ply -> legal moves, only for plies that were displayed
+        self.evaluations = {}   #ply -> scoreBoard of the position
+        self.checkpoint()
+        if self.ply:    #the checkpoints of the moves made before, and the one at the start of the line
+            target = self.ply
+            for i in range(target):
+                self.gs.undoMove()
+            self.ply = 0
+            self.checkpoint()
+            self.step(target)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def atEnd(self):
+        return self.ply == len(self.moves)
+
+    '''
+    Saves the position at the current ply if it is on a checkpoint. Ply 0 always is one, it is where the line starts.
+    '''
+    def checkpoint(self):
+        if self.ply % self.checkpointInterval == 0:
+            self.checkpoints[self.ply] = (tuple("".join(row) for row in self.gs.board), self.gs.whiteToMove,
+                                          self.gs.whiteKingLocation, self.gs.blackKingLocation)
+
+    '''
+    Plays a move at the current ply. When the current ply is not the end of the line, the rest of the line is
+    replaced by the move.
+    '''
+    def makeMove(self, move):
+        if not self.atEnd():
+            self.truncate()
+        self.gs.makeMove(move)
+        self.moves.append(move)
+        self.ply += 1
+        self.record()
+        self.checkpoint()
+
+    '''
+    Takes back the last move played: goes back one ply and drops the rest of the line
+    '''
+    def undoMove(self):
+        if self.ply:
+            self.seek(self.ply - 1)
+            self.truncate()
+
+    def truncate(self):
+        del self.moves[self.ply:]
+        del self.history[self.ply + 1:]
+        for ply in [ply for ply in self.checkpoints if ply > self.ply]:
+            del self.checkpoints[ply]
+        for cache in (self.validMoves, self.evaluations):
+            for ply in [ply for ply in cache if ply >= self.ply]:
+                del cache[ply]
+
+    def record(self):
+        rights = self.gs.currentCastlingRight
+        self.history.append((self.gs.enpassantPossible, (rights.wks, rights.bks, rights.wqs, rights.bqs),
+                             self.gs.pawnKey, self.gs.zobristKey))
+
+    '''
+    Makes the GameState the position after ply plies of the line, from the current position or from the nearest
+    checkpoint, whichever is fewer moves away
+    '''
+    def seek(self, ply):
+        ply = max(0, min(ply, len(self.moves)))
+        nearest = min(self.checkpoints, key=lambda checkpointPly: abs(checkpointPly - ply))
+        if abs(nearest - ply) < abs(self.ply - ply):
+            self.restore(nearest)
+        self.step(ply)
+
+    def step(self, ply):
+        while self.ply > ply:
+            self.gs.undoMove()
+            self.ply -= 1
+        while self.ply < ply:
+            self.gs.makeMove(self.moves[self.ply])
+            self.ply += 1
+            self.checkpoint()
+
+    '''
+    Sets the GameState to a checkpoint, with the move log and the logs of the line up to it
+    '''
+    def restore(self, ply):
+        gs = self.gs
+        board, gs.whiteToMove, gs.whiteKingLocation, gs.blackKingLocation = self.checkpoints[ply]
+        gs.board = [[row[i:i + 2] for i in range(0, 16, 2)] for row in board]
+        gs.moveLog = self.moves[:ply]
+        history = self.history[:ply + 1]
+        gs.enpassantPossibleLog = [entry[0] for entry in history]
+        gs.castleRightsLog = [ChessEngine.CastleRights(*entry[1]) for entry in history]
+        gs.pawnKeyLog = [entry[2] for entry in history]
+        gs.zobristKeyLog = [entry[3] for entry in history]
+        gs.enpassantPossible = gs.enpassantPossibleLog[-1]
+        gs.currentCastlingRight = ChessEngine.CastleRights(*history[-1][1])
+        gs.pawnKey = gs.pawnKeyLog[-1]
+        gs.zobristKey = gs.zobristKeyLog[-1]
+        gs.checkMate = False
+        gs.staleMate = False
+        self.ply = ply
+
+    '''
+    The legal moves of the current position, generated the first time they are asked for at this ply
+    '''
+    def getValidMoves(self):
+        validMoves = self.validMoves.get(self.ply)
+        if validMoves is None:
+            validMoves = self.validMoves[self.ply] = self.gs.getValidMoves()
+        else:   #getValidMoves sets the end of game flags, seeking clears them
+            inCheck = not validMoves and self.gs.inCheck()
+            self.gs.checkMate = inCheck
+            self.gs.staleMate = not validMoves and not inCheck
+        return validMoves
+
+    '''
+    SmartMoveFinder's evaluation of the current position, worked out the first time it is asked for at this ply
+    '''
+    def evaluate(self):
+        if self.ply not in self.evaluations:
+            self.getValidMoves()
+            self.evaluations[self.ply] = SmartMoveFinder.scoreBoard(self.gs)
+        return self.evaluations[self.ply]
@@ -0,0 +1,373 @@
+"""
+Asyncio game server. Hosts many games at once, each one a GameState kept in memory, and sends the AI moves to a
+bounded pool of worker processes running SmartMoveFinder.
+
+The protocol is one JSON object per line over TCP (a stand-in for a websocket), every request gets one JSON line back:
+    {"cmd": "new"}                                  -> {"ok": true, "game": 1, ...state}
+    {"cmd": "new", "level": "casual"}               -> a game against one of SmartMoveFinder.STRENGTH_LEVELS
+    {"cmd": "level", "game": 1, "level": "beginner"}    -> change the level of a game, null searches to the depth
+    {"cmd": "move", "game": 1, "move": "e2e4"}      -> play a move given in coordinate notation
+    {"cmd": "ai", "game": 1, "time": 1.5}           -> let the engine play, searching for at most "time" seconds
+    {"cmd": "analyse", "game": 1, "lines": 3}       -> the best "lines" moves with their scores and variations
+    {"cmd": "state", "game": 1}
+    {"cmd": "close", "game": 1}
+    {"cmd": "metrics"}                              -> queue depth, request counts and latency percentiles
+
+A game has at most one AI request waiting or running at a time and the requests are served in arrival order, so every
+game gets its turn and no single game can take over the workers. When every worker is busy and maxQueueDepth requests
+are already waiting new AI requests are refused with "busy" (backpressure) instead of piling up.
+
+Usage (from the repository root):
+    python -m Chess.GameServer --port 8765 --workers 4
+    python -m Chess.GameServer --cache analysis.sqlite      #answer positions analysed before from the file
+"""
+import argparse
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from Chess import AnalysisCache, ChessEngine, SmartMoveFinder
+
+DEFAULT_TIME_BUDGET = 2.0   #seconds of search for an AI move when the request does not say
+MAX_TIME_BUDGET = 30.0
+MAX_LINES = 10             #most lines an analysis can ask for
+MAX_QUEUE_DEPTH = 256       #AI requests waiting for a worker before new ones are refused
+GAME_COMMANDS = ("state", "level", "move", "ai", "analyse", "close")   #the commands about one game, which need "game"
+LATENCY_SAMPLES = 10000     #the percentiles are computed over the most recent requests
+
+
+'''
+Runs in the worker processes: opens the analysis cache, if there is one
+'''
+def initWorker(cachePath=None):
+    if cachePath is not None:
+        SmartMoveFinder.analysisCache = AnalysisCache.AnalysisCache(cachePath)
+
+'''
+Sets the search globals of a worker for one request: the depth of the game and the time budget of the request, or the
+budgets of a strength level within that time. The worker keeps its globals between requests, so all of them are set.
+Returns the time budget.
+'''
+def configureSearch(depth, timeBudget, level=None):
+    SmartMoveFinder.DEPTH = depth
+    SmartMoveFinder.NODE_LIMIT = None
+    SmartMoveFinder.EVALUATION_NOISE = 0
+    if level is not None:
+        SmartMoveFinder.setStrength(level)
+        timeBudget = min(timeBudget, SmartMoveFinder.TIME_LIMIT or timeBudget)
+    SmartMoveFinder.TIME_LIMIT = timeBudget
+    return timeBudget
+
+'''
+Runs in a worker process: searches the position for at most timeBudget seconds, with the budgets of level if it is
+given. The time budget is enforced with the stop signal of findBestMove, so the best move of the last completed
+iteration comes back on time.
+Returns (moveID or None, nodes searched, seconds spent)
+'''
+def searchMove(gs, depth, timeBudget, level=None):
+    timeBudget = configureSearch(depth, timeBudget, level)
+    stopEvent = threading.Event()
+    timer = threading.Timer(timeBudget, stopEvent.set)
+    returnQueue = queue.Queue()
+    startTime = time.perf_counter()
+    timer.start()
+    try:
+        SmartMoveFinder.findBestMove(gs, gs.getValidMoves(), returnQueue, stopEvent)
+    finally:
+        timer.cancel()
+    move = returnQueue.get()
+    return (None if move is None else move.moveID), SmartMoveFinder.counter, time.perf_counter() - startTime
+
+'''
+Runs in a worker process: multi-PV analysis of the position for at most timeBudget seconds.
+Returns ([(moveID, score, pv in coordinate notation)], nodes searched, seconds spent)
+'''
+def analysePosition(gs, depth, timeBudget, lineCount):
+    configureSearch(depth, timeBudget)
+    stopEvent = threading.Event()
+    timer = threading.Timer(timeBudget, stopEvent.set)
+    startTime = time.perf_counter()
+    timer.start()
+    try:
+        lines = SmartMoveFinder.findBestLines(gs, gs.getValidMoves(), lineCount, stopEvent)
+    finally:
+        timer.cancel()
+    lines = [(move.moveID, score, [pvMove.getChessNotation() for pvMove in pv]) for move, score, pv in lines]
+    return lines, SmartMoveFinder.counter, time.perf_counter() - startTime
+
+'''
+Nearest rank percentiles of a list of samples, in milliseconds
+'''
+def percentiles(samples, points=(50, 90, 99)):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    result = {"p%d" % point: round(1000 * ordered[min(len(ordered) - 1, len(ordered) * point // 100)], 2)
+              for point in points}
+    result["max"] = round(1000 * ordered[-1], 2)
+    return result
+
+
+class ServerError(Exception):
+    pass
+
+def checkLevel(level):
+    if level is not None and level not in SmartMoveFinder.STRENGTH_LEVELS:
+        raise ServerError("unknown level %s, the levels are %s" % (level, ", ".join(SmartMoveFinder.STRENGTH_LEVELS)))
+
+'''
+One game on the server. The valid moves are only generated when they are needed and kept until the next move.
+'''
+class Session():
+    def __init__(self, gameId, depth, level=None):
+        self.gameId = gameId
+        self.depth = depth
+        self.level = level  #a name of SmartMoveFinder.STRENGTH_LEVELS, None searches to depth
+        self.gs = ChessEngine.GameState()
+        self.validMoves = None
+        self.thinking = False   #an AI request for this game is waiting or running
+
+    def getValidMoves(self):
+        if self.validMoves is None:
+            self.validMoves = self.gs.getValidMoves()
+        return self.validMoves
+
+    def makeMove(self, move):
+        self.gs.makeMove(move)
+        self.validMoves = None
+
+    def findMove(self, notation=None, moveID=None):
+        for move in self.getValidMoves():
+            if move.getChessNotation() == notation or move.moveID == moveID:
+                return move
+        return None
+
+    def state(self):
+        validMoves = self.getValidMoves()
+        status = "checkmate" if self.gs.checkMate else "stalemate" if self.gs.staleMate else "playing"
+        return {"game": self.gameId, "turn": "w" if self.gs.whiteToMove else "b", "status": status, "level": self.level,
+                "moves": [move.getChessNotation() for move in self.gs.moveLog],
+                "legal": [move.getChessNotation() for move in validMoves]}
+
+
+class GameServer():
+    def __init__(self, workers=None, maxQueueDepth=MAX_QUEUE_DEPTH, depth=SmartMoveFinder.DEPTH, cachePath=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.depth = depth
+        self.sessions = {}
+        self.nextGameId = 1
+        self.pool = ProcessPoolExecutor(self.workers, initializer=initWorker, initargs=(cachePath,))
+        self.requestQueue = None    #made by startDispatchers, inside the event loop
+        self.maxQueueDepth = maxQueueDepth
+        self.dispatchers = []
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)      #from the request arriving to the move being played
+        self.queueWaits = deque(maxlen=LATENCY_SAMPLES)     #from the request arriving to a worker picking it up
+        self.requests = 0
+        self.rejected = 0
+        self.nodes = 0
+        self.searchTime = 0.0
+
+    '''
+    Starts one dispatcher per worker, each one takes the next AI request from the queue and waits for the pool. The
+    queue has room for a request per worker on top of the waiting ones: requests arriving together are all queued
+    before an idle dispatcher gets to take one, so they would otherwise be refused with workers free.
+    '''
+    def startDispatchers(self):
+        self.requestQueue = asyncio.Queue(self.maxQueueDepth + self.workers)
+        for i in range(self.workers):
+            self.dispatchers.append(asyncio.ensure_future(self.dispatch()))
+
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            function, args, future, arrivedAt = await self.requestQueue.get()
+            self.queueWaits.append(time.perf_counter() - arrivedAt)
+            try:
+                result = await loop.run_in_executor(self.pool, function, *args)
+            except Exception as exception:  #a crashed worker fails this request, not the server
+                if not future.done():
+                    future.set_exception(exception)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.requestQueue.task_done()
+
+    def newGame(self, depth=None, level=None):
+        checkLevel(level)
+        session = Session(self.nextGameId, depth or self.depth, level)
+        self.sessions[session.gameId] = session
+        self.nextGameId += 1
+        return session
+
+    def getSession(self, gameId):
+        if gameId not in self.sessions:
+            raise ServerError("unknown game %s" % gameId)
+        return self.sessions[gameId]
+
+    def playMove(self, session, notation):
+        if session.thinking:
+            raise ServerError("the engine is thinking in this game")
+        move = session.findMove(notation=notation)
+        if move is None:
+            raise ServerError("illegal move %s" % notation)
+        session.makeMove(move)
+
+    '''
+    Queues a search of the game's position for the workers and waits for its result. function runs in a worker and
+    returns (result, nodes, seconds).
+    '''
+    async def search(self, session, function, args):
+        if session.thinking:
+            raise ServerError("the engine is already thinking in this game")
+        if not session.getValidMoves():
+            raise ServerError("the game is over")
+        arrivedAt = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.requestQueue.put_nowait((function, (session.gs, session.depth) + args, future, arrivedAt))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise ServerError("busy")
+        self.requests += 1
+        session.thinking = True
+        try:
+            result, nodes, seconds = await future
+        finally:
+            session.thinking = False
+        self.nodes += nodes
+        self.searchTime += seconds
+        self.latencies.append(time.perf_counter() - arrivedAt)
+        return result
+
+    '''
+    Queues an AI move for the game and plays it when a worker has found it
+    '''
+    async def playAIMove(self, session, timeBudget):
+        moveID = await self.search(session, searchMove, (timeBudget, session.level))
+        move = session.findMove(moveID=moveID)
+        if move is None:
+            move = SmartMoveFinder.findRandomMove(session.getValidMoves())
+        session.makeMove(move)
+        return move
+
+    '''
+    Queues a multi-PV analysis of the game's position. The scores are from white's point of view.
+    '''
+    async def analyse(self, session, timeBudget, lineCount):
+        lines = await self.search(session, analysePosition, (timeBudget, lineCount))
+        turnMultiplier = 1 if session.gs.whiteToMove else -1
+        return [{"move": pv[0], "score": round(turnMultiplier * score, 2), "pv": pv} for moveID, score, pv in lines]
+
+    def metrics(self):
+        return {"sessions": len(self.sessions), "workers": self.workers, "queueDepth": self.requestQueue.qsize(),
+                "maxQueueDepth": self.maxQueueDepth, "requests": self.requests, "rejected": self.rejected,
+                "nodesPerSecond": round(self.nodes / self.searchTime) if self.searchTime else 0,
+                "latencyMs": percentiles(self.latencies), "queueWaitMs": percentiles(self.queueWaits)}
+
+    '''
+    Handles one request and returns the reply
+    '''
+    async def handleRequest(self, request):
+        cmd = request.get("cmd")
+        if cmd == "new":
+            return self.newGame(request.get("depth"), request.get("level")).state()
+        if cmd == "metrics":
+            return self.metrics()
+        if cmd not in GAME_COMMANDS:
+            raise ServerError("unknown command %s" % cmd)
+        session = self.getSession(request.get("game"))
+        if cmd == "state":
+            return session.state()
+        if cmd == "level":
+            checkLevel(request.get("level"))
+            session.level = request.get("level")
+            return session.state()
+        if cmd == "move":
+            self.playMove(session, request.get("move"))
+            return session.state()
+        if cmd == "ai":
+            timeBudget = min(float(request.get("time", DEFAULT_TIME_BUDGET)), MAX_TIME_BUDGET)
+            move = await self.playAIMove(session, timeBudget)
+            reply = session.state()
+            reply["move"] = move.getChessNotation()
+            return reply
+        if cmd == "analyse":
+            timeBudget = min(float(request.get("time", DEFAULT_TIME_BUDGET)), MAX_TIME_BUDGET)
+            lineCount = max(1, min(int(request.get("lines", 3)), MAX_LINES))
+            return {"game": session.gameId, "lines": await self.analyse(session, timeBudget, lineCount)}
+        del self.sessions[session.gameId]   #close
+        return {"game": session.gameId, "closed": True}
+
+    '''
+    One connection. Requests are handled concurrently, so a client can wait for the engine in several games at once;
+    the replies carry the game number.
+    '''
+    async def handleClient(self, reader, writer):
+        tasks = set()
+        async def reply(request):
+            try:
+                response = await self.handleRequest(request)
+                response["ok"] = True
+            except ServerError as error:
+                response = {"ok": False, "error": str(error), "game": request.get("game")}
+            except Exception as error:  #a bad request should not take the connection down
+                response = {"ok": False, "error": repr(error), "game": request.get("game")}
+            writer.write((json.dumps(response) + "\n").encode())
+            await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    writer.write(b'{"ok": false, "error": "invalid json"}\n')
+                    continue
+                task = asyncio.ensure_future(reply(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        self.startDispatchers()
+        server = await asyncio.start_server(self.handleClient, host, port)
+        print("serving on %s:%d with %d workers" % (host, port, self.workers))
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        self.pool.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve many chess games over TCP, one JSON request per line")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="engine processes (default: one per cpu)")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE_DEPTH, help="AI requests waiting before refusing")
+    parser.add_argument("--depth", type=int, default=SmartMoveFinder.DEPTH, help="default search depth of new games")
+    parser.add_argument("--cache", metavar="FILE", help="keep the AI's analyses in this SQLite file across restarts")
+    args = parser.parse_args(argv)
+    gameServer = GameServer(args.workers, args.max_queue, args.depth, args.cache)
+    try:
+        asyncio.run(gameServer.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gameServer.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+Headless match runner. Plays engine vs engine games between two configurations of SmartMoveFinder on a process pool,
+without pygame. Every opening is played twice with the colours swapped, and at the end it reports the score, the Elo
+difference with error bars, an SPRT verdict and the speed of both engines.
+
+Usage (from the repository root):
+    python -m Chess.MatchRunner --games 40 --processes 4 --a depth=2 --b depth=1
+    python -m Chess.MatchRunner --a depth=3 time=2 --b depth=3 time=2 doubledPawnPenalty=0.4 pieceScore.Q=9
+    python -m Chess.MatchRunner --a evaluation=tuned.json --b
+    python -m Chess.MatchRunner --a level=casual --b level=intermediate
+    python -m Chess.MatchRunner --games 2 --profile search.folded     #in this process, with the Profiler on
+"""
+import argparse
+import contextlib
+import math
+import queue
+import random
+import time
+from multiprocessing import Pool
+
+from Chess import ChessEngine, Profiler, SmartMoveFinder
+
+MAX_PLIES = 200     #games still running after this many plies are adjudicated as a draw
+REPETITIONS = 3     #the same position this many times is a draw
+
+#short opening lines in coordinate notation, played by both engines from both sides
+OPENINGS = [
+    "",
+    "e2e4 e7e5",
+    "e2e4 c7c5",
+    "e2e4 e7e6",
+    "e2e4 c7c6",
+    "d2d4 d7d5",
+    "d2d4 g8f6",
+    "c2c4 e7e5",
+    "g1f3 d7d5",
+    "e2e4 e7e5 g1f3 b8c6",
+    "d2d4 d7d5 c2c4 e7e6",
+    "d2d4 g8f6 c2c4 g7g6",
+]
+
+#short names that can be used in an engine configuration instead of the SmartMoveFinder global
+CONFIG_ALIASES = {"depth": "DEPTH", "time": "TIME_LIMIT", "nodes": "NODE_LIMIT", "noise": "EVALUATION_NOISE"}
+
+
+'''
+Applies an engine configuration to SmartMoveFinder for the duration of a with block and puts the old values back
+afterwards. Keys are SmartMoveFinder globals (or an alias) and "table.key" sets one entry of a global dictionary,
+for example {"depth": 3, "doubledPawnPenalty": 0.3, "pieceScore.Q": 9}. "evaluation" loads piece values and tables from
+a json file and "level" sets the globals of one of the STRENGTH_LEVELS, which the keys after it can change.
+'''
+@contextlib.contextmanager
+def engineConfig(config, pawnHashTable, transpositionTable):
+    saved = []
+    items = []
+    for name, value in config.items():
+        if name == "level":
+            if value not in SmartMoveFinder.STRENGTH_LEVELS:
+                raise ValueError("unknown strength level: %s" % value)
+            items.extend(SmartMoveFinder.STRENGTH_LEVELS[value].items())
+        else:
+            items.append((name, value))
+    for name, value in items:
+        name = CONFIG_ALIASES.get(name, name)
+        if name == "evaluation":    #a json file of piece values and tables, as written by TexelTuner
+            saved.append((None, None, SmartMoveFinder.getEvaluation()))
+            SmartMoveFinder.loadEvaluation(value)
+        elif '.' in name:
+            tableName, key = name.split('.', 1)
+            table = getattr(SmartMoveFinder, tableName)
+            saved.append((table, key, table[key]))
+            table[key] = value
+        elif hasattr(SmartMoveFinder, name):
+            saved.append((None, name, getattr(SmartMoveFinder, name)))
+            setattr(SmartMoveFinder, name, value)
+        else:
+            raise ValueError("unknown engine parameter: " + name)
+    #every engine keeps its own hash tables, the cached scores depend on its evaluation parameters
+    saved.append((None, "pawnHashTable", SmartMoveFinder.pawnHashTable))
+    saved.append((None, "transpositionTable", SmartMoveFinder.transpositionTable))
+    SmartMoveFinder.pawnHashTable = pawnHashTable
+    SmartMoveFinder.transpositionTable = transpositionTable
+    try:
+        yield
+    finally:
+        for table, name, value in reversed(saved):
+            if name is None:
+                SmartMoveFinder.setEvaluation(value)
+            elif table is None:
+                setattr(SmartMoveFinder, name, value)
+            else:
+                table[name] = value
+
+'''
+Plays the opening line given in coordinate notation ("e2e4 e7e5") on the GameState
+'''
+def playOpening(gs, opening):
+    for notation in opening.split():
+        for move in gs.getValidMoves():
+            if move.getChessNotation() == notation:
+                gs.makeMove(move)
+                break
+        else:
+            raise ValueError("illegal move in opening: " + notation)
+
+'''
+Key of the position for repetition detection
+'''
+def positionKey(gs):
+    rights = gs.currentCastlingRight
+    return (tuple(map(tuple, gs.board)), gs.whiteToMove, gs.enpassantPossible, rights.wks, rights.bks, rights.wqs, rights.bqs)
+
+'''
+Plays one game. engines is (whiteConfig, blackConfig). Returns the result from white's point of view (1, 0.5 or 0),
+a reason, and per side the number of moves, nodes searched, seconds spent thinking, and the hits and probes of its
+pawn hash table and its transposition table.
+'''
+def playGame(opening, engines, seed):
+    random.seed(seed)   #findBestMove shuffles the moves, so every game gets its own reproducible seed
+    gs = ChessEngine.GameState()
+    playOpening(gs, opening)
+    pawnHashTables = (SmartMoveFinder.PawnHashTable(), SmartMoveFinder.PawnHashTable())
+    transpositionTables = (SmartMoveFinder.TranspositionTable(), SmartMoveFinder.TranspositionTable())
+    stats = [[0, 0, 0.0], [0, 0, 0.0]]  #moves, nodes, seconds for white and black
+    seen = {}
+    while True:
+        validMoves = gs.getValidMoves()
+        if gs.checkMate:
+            result, reason = (0 if gs.whiteToMove else 1), "checkmate"
+            break
+        if gs.staleMate:
+            result, reason = 0.5, "stalemate"
+            break
+        key = positionKey(gs)
+        seen[key] = seen.get(key, 0) + 1
+        if seen[key] >= REPETITIONS:
+            result, reason = 0.5, "repetition"
+            break
+        if len(gs.moveLog) >= MAX_PLIES:
+            result, reason = 0.5, "move limit"
+            break
+
+        side = 0 if gs.whiteToMove else 1
+        returnQueue = queue.Queue()
+        startTime = time.time()
+        with engineConfig(engines[side], pawnHashTables[side], transpositionTables[side]):
+            SmartMoveFinder.findBestMove(gs, validMoves, returnQueue)
+        stats[side][2] += time.time() - startTime
+        stats[side][1] += SmartMoveFinder.counter
+        stats[side][0] += 1
+        move = returnQueue.get()
+        if move is None:
+            move = SmartMoveFinder.findRandomMove(validMoves)
+        gs.makeMove(move)
+    for side in range(2):
+        stats[side] += [pawnHashTables[side].hits, pawnHashTables[side].probes, transpositionTables[side].hits,
+                        transpositionTables[side].probes]
+    return result, reason, stats
+
+'''
+Pool worker. task is (gameNumber, opening, configA, configB, aIsWhite, seed). Returns the score of engine A and the
+statistics of both engines, A first.
+'''
+def runGame(task):
+    gameNumber, opening, configA, configB, aIsWhite, seed = task
+    engines = (configA, configB) if aIsWhite else (configB, configA)
+    result, reason, stats = playGame(opening, engines, seed)
+    scoreA = result if aIsWhite else 1 - result
+    statsA, statsB = (stats[0], stats[1]) if aIsWhite else (stats[1], stats[0])
+    return gameNumber, scoreA, reason, statsA, statsB
+
+'''
+Builds the list of games: the openings in order, every one played twice with the colours swapped
+'''
+def makeTasks(games, configA, configB, openings, seed):
+    tasks = []
+    for gameNumber in range(games):
+        opening = openings[(gameNumber // 2) % len(openings)]
+        tasks.append((gameNumber, opening, configA, configB, gameNumber % 2 == 0, seed + gameNumber))
+    return tasks
+
+
+'''
+Expected score for an Elo difference and the Elo difference for a score
+'''
+def eloToScore(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+def scoreToElo(score):
+    if score <= 0:      #a 0% or 100% score has no finite Elo
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return 400 * math.log10(score / (1 - score))
+
+'''
+Elo difference of A over B with a 95% confidence interval, from the wins, draws and losses of A.
+Returns (elo, lowerBound, upperBound). A bound is infinite when the interval reaches a 0% or 100% score. Both bounds
+are None when every game had the same result, which says nothing about the spread, and elo as well without games.
+'''
+def eloDifference(wins, draws, losses):
+    n = wins + draws + losses
+    if n == 0:
+        return None, None, None
+    score = (wins + draws / 2) / n
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / n
+    if variance == 0:
+        return scoreToElo(score), None, None
+    margin = 1.96 * math.sqrt(variance / n)
+    return scoreToElo(score), scoreToElo(score - margin), scoreToElo(score + margin)
+
+'''
+Log likelihood ratio of H1 (A is elo1 stronger) against H0 (A is elo0 stronger), using the normal approximation
+of the trinomial model. Returns (llr, lowerBound, upperBound, verdict)
+'''
+def sprt(wins, draws, losses, elo0=0, elo1=5, alpha=0.05, beta=0.05):
+    lower = math.log(beta / (1 - alpha))
+    upper = math.log((1 - beta) / alpha)
+    n = wins + draws + losses
+    if n == 0:
+        return 0.0, lower, upper, "inconclusive"
+    score = (wins + draws / 2) / n
+    variance = (wins + draws / 4) / n - score ** 2
+    if variance <= 0:   #every game had the same result, no information about the spread yet
+        return 0.0, lower, upper, "inconclusive"
+    s0 = eloToScore(elo0)
+    s1 = eloToScore(elo1)
+    llr = (s1 - s0) * (2 * score - s0 - s1) / (2 * variance / n)
+    if llr >= upper:
+        verdict = "H1 accepted (A is stronger by at least %g Elo)" % elo1
+    elif llr <= lower:
+        verdict = "H0 accepted (A is not stronger by %g Elo)" % elo1
+    else:
+        verdict = "inconclusive"
+    return llr, lower, upper, verdict
+
+'''
+Plays the match on a process pool and prints the games as they finish and the summary at the end.
+With a profile path the games are played one after the other in this process with the Profiler on instead, and the
+breakdown is printed and the collapsed stacks written to that path.
+Returns (wins, draws, losses) of engine A.
+'''
+def runMatch(configA, configB, games, processes=None, openings=OPENINGS, seed=0, elo0=0, elo1=5, alpha=0.05, beta=0.05,
+             profile=None):
+    tasks = makeTasks(games, configA, configB, openings, seed)
+    wins = draws = losses = 0
+    totals = {"A": [0, 0, 0.0, 0, 0, 0, 0], "B": [0, 0, 0.0, 0, 0, 0, 0]}
+    startTime = time.time()
+    with (Pool(processes) if profile is None else Profiler.profiling()) as pool:
+        results = map(runGame, tasks) if pool is None else pool.imap_unordered(runGame, tasks)
+        for gameNumber, scoreA, reason, statsA, statsB in results:
+            if scoreA == 1:
+                wins += 1
+            elif scoreA == 0:
+                losses += 1
+            else:
+                draws += 1
+            for name, stats in (("A", statsA), ("B", statsB)):
+                for i in range(len(stats)):
+                    totals[name][i] += stats[i]
+            print("game %d: A scored %g (%s)  [+%d =%d -%d]" % (gameNumber + 1, scoreA, reason, wins, draws, losses))
+
+    print()
+    print("%d games in %.1f s: A +%d =%d -%d" % (games, time.time() - startTime, wins, draws, losses))
+    elo, eloLow, eloHigh = eloDifference(wins, draws, losses)
+    if elo is None:
+        print("Elo difference A - B: n/a (no games)")
+    elif eloLow is None:
+        print("Elo difference A - B: %.1f (95%% interval n/a, every game had the same result)" % elo)
+    else:
+        print("Elo difference A - B: %.1f (95%% interval %.1f to %.1f)" % (elo, eloLow, eloHigh))
+    llr, lower, upper, verdict = sprt(wins, draws, losses, elo0, elo1, alpha, beta)
+    print("SPRT [%g, %g]: LLR %.2f (bounds %.2f, %.2f) %s" % (elo0, elo1, llr, lower, upper, verdict))
+    for name in ("A", "B"):
+        moves, nodes, seconds, pawnHits, pawnProbes, transpositionHits, transpositionProbes = totals[name]
+        print("engine %s: %d moves, %.0f nodes/s, %.3f s/move, pawn hash %.1f%% and transposition table %.1f%% hits"
+              % (name, moves, nodes / seconds if seconds else 0, seconds / moves if moves else 0,
+                 100.0 * pawnHits / pawnProbes if pawnProbes else 0,
+                 100.0 * transpositionHits / transpositionProbes if transpositionProbes else 0))
+    if profile is not None:
+        print()
+        print(Profiler.report())
+        Profiler.writeCollapsed(profile)
+        print("collapsed stacks written to " + profile)
+    return wins, draws, losses
+
+'''
+Parses "name=value" engine parameters, values are read as numbers when possible
+'''
+def parseConfig(pairs):
+    config = {}
+    for pair in pairs:
+        name, value = pair.split('=', 1)
+        try:
+            config[name] = int(value)
+        except ValueError:
+            try:
+                config[name] = float(value)
+            except ValueError:
+                config[name] = None if value == "None" else value
+    return config
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play a headless engine vs engine match")
+    parser.add_argument("--a", nargs="*", default=[], metavar="NAME=VALUE", help="configuration of engine A")
+    parser.add_argument("--b", nargs="*", default=[], metavar="NAME=VALUE", help="configuration of engine B")
+    parser.add_argument("--games", type=int, default=2 * len(OPENINGS))
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per cpu)")
+    parser.add_argument("--openings", help="file with one opening per line in coordinate notation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--elo0", type=float, default=0)
+    parser.add_argument("--elo1", type=float, default=5)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--profile", metavar="FILE", help="play in this process with profiling, write collapsed stacks to FILE")
+    args = parser.parse_args(argv)
+    openings = OPENINGS
+    if args.openings:
+        with open(args.openings) as f:
+            openings = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    runMatch(parseConfig(args.a), parseConfig(args.b), args.games, args.processes, openings, args.seed,
+             args.elo0, args.elo1, args.alpha, args.beta, args.profile)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Mate solver: finds a forced checkmate in at most N moves, much faster than the general search, by only looking at the
+moves that matter for a mate.
+
+The attacker only plays checking moves (every move with checksOnly=False, for problems with a quiet key move) and the
+defender tries all of its legal replies. It is a depth-first AND/OR search, deepened one move at a time so the first
+mate found is the shortest one, not proof-number search: the attacker's moves are only tried in order of how few
+replies they leave the defender. Both searches stop at the first answer they need, and the defender's replies are
+bounded by mate distance: once one reply is mated in N moves, a later reply is first tested for a mate in N, and only
+the replies that hold out longer are searched for the length of their mate. Every position is remembered in two tables
+by its zobrist key: the mates proven from it and the longest mate it has been shown not to have, so transpositions and
+the re-searches of the deepening are answered without searching.
+
+Usage (from the repository root):
+    python -m Chess.MateSearch solve "6rk/6pp/8/6N1/8/8/8/6K1 w - -" --moves 3
+    python -m Chess.MateSearch bench        #time to solve the problems of MATE_SUITE
+"""
+import argparse
+import sys
+import time
+
+from Chess import ChessEngine
+
+#(name, FEN, moves to mate) - every one of them can be solved with checks only
+MATE_SUITE = [
+    ("back rank", "6k1/5ppp/8/8/8/8/8/R5K1 w - -", 1),
+    ("smothered", "6rk/6pp/8/6N1/8/8/8/6K1 w - -", 1),
+    ("queen and king", "k7/8/1K6/8/8/8/8/6Q1 w - -", 1),
+    ("Arabian", "7k/R7/5N2/8/8/8/8/6K1 w - -", 1),
+    ("Legal", "r2qkbnr/ppp2ppp/2np4/4N3/2B1P3/2N5/PPPP1PPP/R1BbK2R w KQkq -", 2),
+    ("Morphy opera game", "4kb1r/p2n1ppp/4q3/4p1B1/4P3/1Q6/PPP2PPP/2KR4 w k -", 2),
+    ("knight sacrifice", "r2qkb1r/pp2nppp/3p4/2pNN1B1/2BnP3/3P4/PPP2PPP/R2bK2R w KQkq -", 2),
+    ("Reti - Tartakower", "rnb1kb1r/pp3ppp/2p5/4q3/4n3/3Q4/PPPB1PPP/2KR1BNR w kq -", 3),
+    ("Philidor's legacy", "1r5k/6pp/8/6N1/2Q5/8/8/6K1 w - -", 4),
+    ("Lasker - Thomas", "rn3rk1/pbppq1pp/1p2pb2/4N2Q/3PN3/3B4/PPP2PPP/R3K2R w KQ -", 7),   #the game took 8
+]
+
+
+class MateSearch():
+    def __init__(self, checksOnly=True):
+        self.checksOnly = checksOnly
+        self.mates = {}     #zobrist key -> (moves, line) of a mate proven from the position
+        self.noMates = {}   #zobrist key -> the most moves the position has been shown to have no mate in
+        self.nodes = 0
+
+    '''
+    The shortest forced mate for the player to move in at most maxMoves moves, as (moves, line) where line is the
+    main line in Move objects with the longest defence. (None, []) when there is none.
+    '''
+    def findMate(self, gs, maxMoves):
+        for moves in range(1, maxMoves + 1):
+            line = self.attack(gs, moves)
+            if line is not None:
+                return moves, line
+        return None, []
+
+    '''
+    The attacker to move mates in at most moves moves: returns the line or None
+    '''
+    def attack(self, gs, moves):
+        key = gs.zobristKey
+        proven = self.mates.get(key)
+        if proven is not None and proven[0] <= moves:
+            return proven[1]
+        if self.noMates.get(key, 0) >= moves:
+            return None
+        self.nodes += 1
+        #the candidates, with the defender's replies, fewest replies first. A reply list of None is a stalemate
+        candidates = []
+        for move in gs.getValidMoves():
+            gs.makeMove(move)
+            if gs.checkForPinsAndChecks()[0] or (not self.checksOnly and moves > 1):  #looks from the king, inCheck makes every move
+                replies = gs.getValidMoves()
+                if not replies and gs.checkMate:
+                    gs.undoMove()
+                    self.mates[key] = (1, [move])
+                    return [move]
+                if replies:
+                    candidates.append((len(replies), len(candidates), move, replies))
+            gs.undoMove()
+        if moves > 1:
+            candidates.sort()
+            for replyCount, order, move, replies in candidates:
+                gs.makeMove(move)
+                line = self.defend(gs, replies, moves - 1)
+                gs.undoMove()
+                if line is not None:
+                    self.mates[key] = (moves, [move] + line)
+                    return [move] + line
+        self.noMates[key] = max(self.noMates.get(key, 0), moves)
+        return None
+
+    '''
+    The defender to move, with these replies, is mated in at most moves moves whatever it plays: returns the line of
+    the reply that holds out the longest, or None when a reply escapes
+    '''
+    def defend(self, gs, replies, moves):
+        self.nodes += 1
+        longest = None
+        for reply in replies:
+            gs.makeMove(reply)
+            bound = len(longest) // 2 if longest is not None else 0    #moves to mate after the longest defence so far
+            if bound and self.attack(gs, bound) is not None:    #mated no later: not the longest, its length is not needed
+                gs.undoMove()
+                continue
+            line = None
+            for length in range(bound + 1, moves + 1):  #the shortest mate after this reply, longer than the bound
+                line = self.attack(gs, length)
+                if line is not None:
+                    break
+            gs.undoMove()
+            if line is None:
+                return None
+            longest = [reply] + line
+        return longest
+
+
+'''
+API: the shortest forced mate in at most maxMoves moves in the position of gs (or a FEN string). Returns
+(moves, line in SAN) or (None, []).
+'''
+def findMate(position, maxMoves, checksOnly=True):
+    gs = position
+    if isinstance(position, str):
+        gs = ChessEngine.GameState()
+        gs.setFEN(position)
+    moves, line = MateSearch(checksOnly).findMate(gs, maxMoves)
+    return moves, lineToSAN(gs, line)
+
+def lineToSAN(gs, line):
+    sans = []
+    for move in line:
+        sans.append(gs.getSAN(move))
+        gs.makeMove(move)
+    for move in line:
+        gs.undoMove()
+    return sans
+
+def solve(fen, maxMoves, checksOnly=True):
+    gs = ChessEngine.GameState()
+    gs.setFEN(fen)
+    search = MateSearch(checksOnly)
+    startTime = time.perf_counter()
+    moves, line = search.findMate(gs, maxMoves)
+    elapsed = time.perf_counter() - startTime
+    if moves is None:
+        print("no mate in %d found (%d nodes, %.2f s)" % (maxMoves, search.nodes, elapsed))
+    else:
+        print("mate in %d: %s (%d nodes, %.2f s)" % (moves, " ".join(lineToSAN(gs, line)), search.nodes, elapsed))
+    return moves
+
+'''
+Solves the problems of MATE_SUITE and prints the time to solve each. Returns True when all are solved at the right
+length.
+'''
+def bench(checksOnly=True):
+    solved = 0
+    totalTime = 0.0
+    for name, fen, expected in MATE_SUITE:
+        gs = ChessEngine.GameState()
+        gs.setFEN(fen)
+        search = MateSearch(checksOnly)
+        startTime = time.perf_counter()
+        moves, line = search.findMate(gs, expected)
+        elapsed = time.perf_counter() - startTime
+        totalTime += elapsed
+        if moves == expected:
+            solved += 1
+        print("%-20s mate in %d: %-10s %8d nodes %9.3f s   %s" % (name, expected, "solved" if moves == expected else
+                                                               "NOT SOLVED", search.nodes, elapsed,
+                                                               " ".join(lineToSAN(gs, line))))
+    print("%d of %d solved in %.2f s" % (solved, len(MATE_SUITE), totalTime))
+    return solved == len(MATE_SUITE)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find forced mates")
+    sub = parser.add_subparsers(dest="command", required=True)
+    solveParser = sub.add_parser("solve", help="find the shortest mate in a position")
+    solveParser.add_argument("fen")
+    solveParser.add_argument("--moves", type=int, default=3, help="longest mate to look for")
+    solveParser.add_argument("--all-moves", action="store_true", help="let the attacker play quiet moves as well")
+    benchParser = sub.add_parser("bench", help="time to solve the mate suite")
+    benchParser.add_argument("--all-moves", action="store_true")
+    args = parser.parse_args(argv)
+    if args.command == "solve":
+        if solve(args.fen, args.moves, not args.all_moves) is None:
+            sys.exit(1)
+    elif not bench(not args.all_moves):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
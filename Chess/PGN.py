@@ -0,0 +1,277 @@
+"""
+Streaming PGN reader and writer around GameState.
+
+readGames is a generator that reads one game at a time from an open file, so a database of any size is read with
+constant memory. Every game comes back as a PGNGame with its tags and its moves in SAN; replay() plays them on a
+GameState. writeGame writes a game back out, with the SAN generated by GameState.getSAN.
+
+Usage (from the repository root):
+    python -m Chess.PGN bench                   #benchmark on generated games
+    python -m Chess.PGN bench games.pgn         #benchmark on a database
+    python -m Chess.PGN check games.pgn         #replay every game and report the ones with illegal moves
+
+Throughput target on the generated benchmark (200 games of up to 120 plies), single process:
+    reading the tags and moves          >= 5000 games/s
+    reading and replaying on GameState  >= 300 games/s
+    writing with full SAN               >= 30 games/s
+"""
+import argparse
+import io
+import random
+import re
+import sys
+import time
+
+from Chess import ChessEngine
+
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+LINE_LENGTH = 79
+
+tagPattern = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+tokenPattern = re.compile(r'\{[^}]*\}?|\(|\)|\$\d+|[^\s(){}]+')
+moveNumberPattern = re.compile(r'^\d+\.+')
+
+
+class PGNGame():
+    def __init__(self, headers=None, moves=None, result="*"):
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []  #the moves of the main line in SAN
+        self.result = result
+
+    '''
+    A new GameState at the start of the game: the position of the FEN tag (with SetUp "1") when there is one, the
+    initial position otherwise. Raises ValueError for a FEN that can not be read.
+    '''
+    def startPosition(self):
+        gs = ChessEngine.GameState()
+        if "FEN" in self.headers:
+            try:
+                gs.setFEN(self.headers["FEN"])
+            except (KeyError, IndexError):     #a bad en passant square
+                raise ValueError("invalid FEN: " + self.headers["FEN"])
+        return gs
+
+    '''
+    Plays the moves on the game's start position and returns the GameState. Raises ValueError for a bad FEN tag and at
+    the first move that can not be played, with strict at the first illegal one (see GameState.parseSAN).
+    '''
+    def replay(self, strict=False):
+        gs = self.startPosition()
+        for san in self.moves:
+            gs.makeMove(gs.parseSAN(san, strict))
+        return gs
+
+
+'''
+Reads the movetext of one game: the main line moves and the result. Comments, variations, NAGs and move numbers are
+skipped.
+'''
+def parseMovetext(text):
+    moves = []
+    result = "*"
+    depth = 0   #nesting of variations
+    for token in tokenPattern.findall(text):
+        if token[0] == '{' or token[0] == '$':
+            continue
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0:
+            if token in RESULTS:
+                result = token
+                continue
+            token = moveNumberPattern.sub('', token)   #1.e4 and 1... are written without a space sometimes
+            if token:
+                moves.append(token)
+    return moves, result
+
+'''
+Generator over the games of a PGN file opened in text mode. Only the current game is held in memory.
+'''
+def readGames(stream):
+    headers = {}
+    movetext = []
+    for line in stream:
+        line = line.strip().lstrip('\ufeff')
+        if not line or line[0] == '%':
+            continue
+        if line[0] == '[':
+            if movetext:    #the tags of the next game start, the previous one is complete
+                yield makeGame(headers, movetext)
+                headers = {}
+                movetext = []
+            match = tagPattern.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+            continue
+        if ';' in line and '{' not in line:     #a comment to the end of the line
+            line = line[:line.index(';')]
+        movetext.append(line)
+    if headers or movetext:
+        yield makeGame(headers, movetext)
+
+def makeGame(headers, movetext):
+    moves, result = parseMovetext(" ".join(movetext))
+    if result == "*" and headers.get("Result") in RESULTS:
+        result = headers["Result"]
+    return PGNGame(headers, moves, result)
+
+'''
+Reads the games of several PGN files in lists of batchSize games, to hand them to worker processes
+'''
+def readGameBatches(paths, batchSize):
+    batch = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as stream:
+            for game in readGames(stream):
+                batch.append(game)
+                if len(batch) == batchSize:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+'''
+The result of a finished GameState in PGN form, "*" while the game goes on
+'''
+def gameResult(gs):
+    if gs.checkMate:
+        return "0-1" if gs.whiteToMove else "1-0"
+    if gs.staleMate:
+        return "1/2-1/2"
+    return "*"
+
+'''
+Makes a PGNGame from the move log of a GameState that started from the initial position. The SAN of every move is
+worked out by replaying the moves on a fresh GameState.
+'''
+def gameFromGameState(gs, headers=None, result=None):
+    replay = ChessEngine.GameState()
+    moves = []
+    for move in gs.moveLog:
+        moves.append(replay.getSAN(move))
+        replay.makeMove(move)
+    if result is None:
+        replay.getValidMoves()
+        result = gameResult(replay)
+    return PGNGame(dict(headers or {}), moves, result)
+
+'''
+Writes one game: the seven tag roster first (with "?" for the missing ones), the other tags, then the movetext
+wrapped at LINE_LENGTH characters
+'''
+def writeGame(stream, game):
+    headers = dict(game.headers)
+    headers["Result"] = game.result
+    for tag in SEVEN_TAG_ROSTER:
+        stream.write('[%s "%s"]\n' % (tag, escapeTag(headers.pop(tag, "?"))))
+    for tag, value in headers.items():
+        stream.write('[%s "%s"]\n' % (tag, escapeTag(value)))
+    stream.write("\n")
+
+    tokens = []
+    for i in range(len(game.moves)):
+        if i % 2 == 0:
+            tokens.append(str(i // 2 + 1) + ".")
+        tokens.append(game.moves[i])
+    tokens.append(game.result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            stream.write(line + "\n")
+            line = token
+        else:
+            line = line + " " + token if line else token
+    stream.write(line + "\n\n")
+
+def escapeTag(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+'''
+Random games for the benchmark, in PGN text
+'''
+def generateGames(count, maxPlies=120, seed=0):
+    random.seed(seed)
+    out = io.StringIO()
+    for i in range(count):
+        gs = ChessEngine.GameState()
+        for ply in range(maxPlies):
+            validMoves = gs.getValidMoves()
+            if not validMoves:
+                break
+            gs.makeMove(random.choice(validMoves))
+        writeGame(out, gameFromGameState(gs, {"Event": "random game", "Round": str(i + 1)}))
+    return out.getvalue()
+
+'''
+Measures reading, replaying and writing throughput in games per second
+'''
+def bench(path=None, count=200):
+    if path is None:
+        print("generating %d random games..." % count)
+        text = generateGames(count)
+        openStream = lambda: io.StringIO(text)
+    else:
+        openStream = lambda: open(path, encoding="utf-8", errors="replace")
+
+    startTime = time.perf_counter()
+    with openStream() as stream:
+        games = sum(1 for game in readGames(stream))
+    readTime = time.perf_counter() - startTime
+
+    startTime = time.perf_counter()
+    plies = 0
+    replayed = []
+    with openStream() as stream:
+        for game in readGames(stream):
+            gs = game.replay()
+            plies += len(gs.moveLog)
+            if len(replayed) < 100:     #a sample for the writing benchmark
+                replayed.append(gs)
+    replayTime = time.perf_counter() - startTime
+
+    startTime = time.perf_counter()
+    out = io.StringIO()
+    for gs in replayed:
+        writeGame(out, gameFromGameState(gs))
+    writeTime = time.perf_counter() - startTime
+
+    print("%d games, %d plies" % (games, plies))
+    print("read:   %8.1f games/s" % (games / readTime))
+    print("replay: %8.1f games/s (%.0f plies/s)" % (games / replayTime, plies / replayTime))
+    print("write:  %8.1f games/s" % (len(replayed) / writeTime))
+
+'''
+Replays every game of a file and reports the ones with an illegal move or one that cannot be played
+'''
+def check(path):
+    good = bad = 0
+    with open(path, encoding="utf-8", errors="replace") as stream:
+        for number, game in enumerate(readGames(stream), 1):
+            try:
+                game.replay(strict=True)
+                good += 1
+            except ValueError as error:
+                bad += 1
+                print("game %d (%s - %s): %s" % (number, game.headers.get("White", "?"), game.headers.get("Black", "?"), error))
+    print("%d games replayed, %d with errors" % (good, bad))
+    return bad == 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PGN tools")
+    parser.add_argument("command", choices=("bench", "check"))
+    parser.add_argument("file", nargs="?")
+    parser.add_argument("--games", type=int, default=200, help="random games to generate for bench without a file")
+    args = parser.parse_args(argv)
+    if args.command == "bench":
+        bench(args.file, args.games)
+    elif args.file is None:
+        parser.error("check needs a file")
+    elif not check(args.file):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+On-disk position index for game database statistics: how often a position was reached, which moves were played from
+it and how the games ended.
+
+The index is one file of fixed size records sorted by (zobrist key, move), read through mmap, so a query is a binary
+search that touches a handful of pages. Building streams the games from PGN, counts the records of a batch of games in
+memory, writes every batch as a sorted run and merges the runs with the existing index into a new file. Adding games
+to an index is the same operation, so new batches can be appended at any time.
+
+Usage (from the repository root):
+    python -m Chess.PositionIndex add index.bin games.pgn [more.pgn ...] [--processes 4]
+    python -m Chess.PositionIndex query index.bin e4 e5 Nf3      #statistics of the position after these moves
+    python -m Chess.PositionIndex bench index.bin                #lookups per second
+"""
+import argparse
+import heapq
+import mmap
+import os
+import random
+import struct
+import tempfile
+import time
+from multiprocessing import Pool
+
+from Chess import ChessEngine, PGN
+
+MAGIC = b'DFPI'
+VERSION = 2     #1 stored a queen promotion as no promotion
+headerFormat = struct.Struct('<4sIQ')       #magic, version, number of records
+recordFormat = struct.Struct('<QHxxIIII')   #key, move, games, white wins, draws, black wins
+keyFormat = struct.Struct('<Q')
+NO_MOVE = 0xFFFF    #the move of a record for a game that ended in the position
+PROMOTIONS = "QRBN"
+BATCH_RECORDS = 500000  #distinct (position, move) pairs counted in memory before a run is written
+GAMES_PER_TASK = 200    #games sent to a worker process at a time
+RESULT_COLUMNS = {"1-0": 1, "1/2-1/2": 2, "0-1": 3}
+
+
+'''
+Moves are stored in 16 bits: starting square * 64 + ending square, with the promotion piece + 1 in the three bits above
+(0 for a move that is not a promotion)
+'''
+def encodeMove(move):
+    code = (move.startRow * 8 + move.startCol) * 64 + move.endRow * 8 + move.endCol
+    if move.isPawnPromotion:
+        code |= (PROMOTIONS.index(move.promotionChoice) + 1) << 12
+    return code
+
+def decodeMove(code):
+    if code == NO_MOVE:
+        return None
+    start, end = (code & 0xFFF) // 64, code & 63
+    notation = ChessEngine.Move.colsToFiles[start % 8] + ChessEngine.Move.rowsToRanks[start // 8] + \
+               ChessEngine.Move.colsToFiles[end % 8] + ChessEngine.Move.rowsToRanks[end // 8]
+    if code >> 12:
+        notation += PROMOTIONS[(code >> 12) - 1].lower()
+    return notation
+
+'''
+The (key, move, result column) of every position of a game from its start position (the FEN tag, if any), including
+the final one. Games with illegal moves are cut at the first illegal move, games with a bad FEN tag have no records.
+A malformed game never stops the build.
+'''
+def gameRecords(game):
+    column = RESULT_COLUMNS.get(game.result, 0)
+    try:
+        gs = game.startPosition()
+    except ValueError:
+        return []
+    records = []
+    key = gs.zobristKey     #of the last position reached, a move that fails can leave gs half made
+    for san in game.moves:
+        try:
+            move = gs.parseSAN(san)
+            gs.makeMove(move)
+        except (ValueError, KeyError, IndexError):     #KeyError and IndexError from a position without a king, say
+            break
+        records.append((key, encodeMove(move), column))
+        key = gs.zobristKey
+    records.append((key, NO_MOVE, column))
+    return records
+
+def gamesRecords(games):
+    records = []
+    for game in games:
+        records.extend(gameRecords(game))
+    return len(games), records
+
+'''
+Writes counted records, sorted, to a new file in the index format and returns its path
+'''
+def writeRun(counts, directory):
+    handle, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(handle, "wb") as f:
+        f.write(headerFormat.pack(MAGIC, VERSION, len(counts)))
+        for (key, move) in sorted(counts):
+            f.write(recordFormat.pack(key, move, *counts[(key, move)]))
+    return path
+
+'''
+Reads the records of an index or run file one after another
+'''
+def readRecords(path, bufferRecords=8192):
+    with open(path, "rb") as f:
+        magic, version, count = headerFormat.unpack(f.read(headerFormat.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a position index" % path)
+        while True:
+            data = f.read(recordFormat.size * bufferRecords)
+            if not data:
+                break
+            yield from recordFormat.iter_unpack(data)
+
+'''
+Merges sorted index files into one, adding up the counts of equal (key, move) records. The result replaces
+outputPath atomically.
+'''
+def mergeFiles(paths, outputPath):
+    directory = os.path.dirname(os.path.abspath(outputPath))
+    handle, tempPath = tempfile.mkstemp(suffix=".tmp", dir=directory)
+    count = 0
+    with os.fdopen(handle, "wb") as f:
+        f.write(headerFormat.pack(MAGIC, VERSION, 0))
+        current = None
+        for key, move, games, white, draws, black in heapq.merge(*[readRecords(path) for path in paths]):
+            if current is not None and current[0] == key and current[1] == move:
+                current[2] += games
+                current[3] += white
+                current[4] += draws
+                current[5] += black
+                continue
+            if current is not None:
+                f.write(recordFormat.pack(*current))
+                count += 1
+            current = [key, move, games, white, draws, black]
+        if current is not None:
+            f.write(recordFormat.pack(*current))
+            count += 1
+        f.seek(0)
+        f.write(headerFormat.pack(MAGIC, VERSION, count))
+    os.replace(tempPath, outputPath)
+    return count
+
+'''
+Adds the games of the PGN files to the index at indexPath, creating it if needed. Games are replayed on a process pool.
+Returns the number of games added.
+'''
+def addGames(indexPath, pgnPaths, processes=None):
+    directory = os.path.dirname(os.path.abspath(indexPath))
+    runs = []
+    counts = {}
+    games = 0
+    startTime = time.time()
+    try:
+        with Pool(processes) as pool:
+            for batchGames, records in pool.imap(gamesRecords, PGN.readGameBatches(pgnPaths, GAMES_PER_TASK)):
+                for key, move, column in records:
+                    entry = counts.get((key, move))
+                    if entry is None:
+                        entry = counts[(key, move)] = [0, 0, 0, 0]
+                    entry[0] += 1
+                    if column:
+                        entry[column] += 1
+                games += batchGames
+                if len(counts) >= BATCH_RECORDS:
+                    runs.append(writeRun(counts, directory))
+                    counts = {}
+                print("%d games, %.0f games/s" % (games, games / (time.time() - startTime)), end="\r")
+        if counts:
+            runs.append(writeRun(counts, directory))
+        sources = runs + ([indexPath] if os.path.exists(indexPath) else [])
+        records = mergeFiles(sources, indexPath)
+    finally:
+        for path in runs:
+            os.remove(path)
+    print()
+    print("index has %d records, %.1f s" % (records, time.time() - startTime))
+    return games
+
+
+class PositionIndex():
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = headerFormat.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a position index" % path)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    '''
+    The records of a position: a list of (move code, games, white wins, draws, black wins)
+    '''
+    def lookup(self, key):
+        data = self.data
+        size = recordFormat.size
+        offset = headerFormat.size
+        low, high = 0, self.count
+        while low < high:   #first record with a key >= key
+            middle = (low + high) // 2
+            if keyFormat.unpack_from(data, offset + middle * size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        records = []
+        while low < self.count:
+            record = recordFormat.unpack_from(data, offset + low * size)
+            if record[0] != key:
+                break
+            records.append(record[1:])
+            low += 1
+        return records
+
+    '''
+    Statistics of the position of a GameState: how often it was reached, the results of those games and the moves
+    played from it, most frequent first
+    '''
+    def stats(self, gs):
+        records = self.lookup(gs.zobristKey)
+        total = [sum(record[i] for record in records) for i in range(1, 5)]
+        moves = sorted(((decodeMove(record[0]),) + record[1:] for record in records if record[0] != NO_MOVE),
+                       key=lambda move: -move[1])
+        return {"games": total[0], "whiteWins": total[1], "draws": total[2], "blackWins": total[3], "moves": moves}
+
+
+def query(indexPath, sanMoves):
+    gs = PGN.PGNGame(moves=sanMoves).replay()
+    with PositionIndex(indexPath) as index:
+        startTime = time.perf_counter()
+        stats = index.stats(gs)
+        elapsed = time.perf_counter() - startTime
+    print("reached %d times: +%d =%d -%d   (%.1f us)" % (stats["games"], stats["whiteWins"], stats["draws"],
+                                                        stats["blackWins"], elapsed * 1e6))
+    for notation, games, white, draws, black in stats["moves"]:
+        print("  %-6s %8d   +%d =%d -%d" % (notation, games, white, draws, black))
+
+def bench(indexPath, lookups=100000):
+    with PositionIndex(indexPath) as index:
+        keys = [keyFormat.unpack_from(index.data, headerFormat.size + random.randrange(index.count) * recordFormat.size)[0]
+                for i in range(min(lookups, 1000))] if index.count else [0]
+        startTime = time.perf_counter()
+        for i in range(lookups):
+            index.lookup(keys[i % len(keys)])
+        elapsed = time.perf_counter() - startTime
+    print("%d records, %.1f us per lookup" % (index.count, elapsed / lookups * 1e6))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Position index of a game database")
+    sub = parser.add_subparsers(dest="command", required=True)
+    addParser = sub.add_parser("add", help="add the games of PGN files to an index, creating it if needed")
+    addParser.add_argument("index")
+    addParser.add_argument("pgn", nargs="+")
+    addParser.add_argument("--processes", type=int, default=None)
+    queryParser = sub.add_parser("query", help="statistics of the position after the given SAN moves")
+    queryParser.add_argument("index")
+    queryParser.add_argument("moves", nargs="*")
+    benchParser = sub.add_parser("bench", help="measure lookup speed")
+    benchParser.add_argument("index")
+    args = parser.parse_args(argv)
+    if args.command == "add":
+        addGames(args.index, args.pgn, args.processes)
+    elif args.command == "query":
+        query(args.index, args.moves)
+    else:
+        bench(args.index)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Opt-in profiling of the engine: call counts, total and self time of move generation, make/undo, evaluation and the
+search, and a collapsed stack file for flame graph tools (flamegraph.pl, speedscope, inferno).
+
+enable() replaces the functions in TARGETS with timing wrappers and disable() puts the originals back, so nothing is
+measured and nothing costs anything until it is switched on. The time of a call is split into the time spent in the
+instrumented calls it makes and its own (self) time, and the self time is recorded under the whole chain of
+instrumented calls that led to it, e.g. "findBestMove;findMoveNegaMaxAlphaBeta;getValidMoves;checkForPinsAndChecks".
+
+Usage:
+    with Profiler.profiling():
+        ...
+    print(Profiler.report())
+    Profiler.writeCollapsed("search.folded")
+or from the repository root:
+    python -m Chess.MatchRunner --games 2 --a depth=2 --b depth=2 --profile search.folded
+"""
+import contextlib
+import functools
+import time
+
+from Chess import ChessEngine, SmartMoveFinder
+
+TARGETS = [
+    (ChessEngine.GameState, "getValidMoves"),
+    (ChessEngine.GameState, "getAllPossibleMoves"),
+    (ChessEngine.GameState, "checkForPinsAndChecks"),
+    (ChessEngine.GameState, "squareUnderAttack"),
+    (ChessEngine.GameState, "makeMove"),
+    (ChessEngine.GameState, "undoMove"),
+    (ChessEngine.GameState, "staticExchange"),
+    (SmartMoveFinder, "findBestMove"),
+    (SmartMoveFinder, "findMoveNegaMaxAlphaBeta"),
+    (SmartMoveFinder, "findMoveQuiescence"),
+    (SmartMoveFinder, "scoreBoard"),
+    (SmartMoveFinder, "scorePawnStructure"),
+]
+
+originals = []  #(owner, name, function) of the wrapped functions while enabled
+frames = []     #[stack path, start time, time in instrumented calls] of the calls being run, innermost last
+active = {}     #name -> calls of it being run, so recursive calls do not count their total time twice
+stats = {}      #name -> [calls, total seconds, self seconds]
+stacks = {}     #stack path -> self seconds
+
+
+def instrument(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        path = frames[-1][0] + ";" + name if frames else name
+        frame = [path, time.perf_counter(), 0.0]
+        frames.append(frame)
+        active[name] = active.get(name, 0) + 1
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - frame[1]
+            frames.pop()
+            active[name] -= 1
+            if frames:
+                frames[-1][2] += elapsed
+            entry = stats.get(name)
+            if entry is None:
+                entry = stats[name] = [0, 0.0, 0.0]
+            entry[0] += 1
+            if active[name] == 0:
+                entry[1] += elapsed
+            entry[2] += elapsed - frame[2]
+            stacks[path] = stacks.get(path, 0.0) + elapsed - frame[2]
+    return wrapper
+
+def enable():
+    if originals:
+        return
+    for owner, name in TARGETS:
+        function = getattr(owner, name)
+        originals.append((owner, name, function))
+        setattr(owner, name, instrument(name, function))
+
+def disable():
+    while originals:
+        owner, name, function = originals.pop()
+        setattr(owner, name, function)
+
+def reset():
+    stats.clear()
+    stacks.clear()
+
+@contextlib.contextmanager
+def profiling():
+    enable()
+    try:
+        yield
+    finally:
+        disable()
+
+'''
+The per function breakdown as text, the functions with the most self time first
+'''
+def report():
+    totalSelf = sum(entry[2] for entry in stats.values()) or 1
+    lines = ["%-26s %10s %10s %10s %7s %10s" % ("function", "calls", "total s", "self s", "self %", "us/call")]
+    for name, (calls, total, selfTime) in sorted(stats.items(), key=lambda item: -item[1][2]):
+        lines.append("%-26s %10d %10.3f %10.3f %6.1f%% %10.1f" % (name, calls, total, selfTime,
+                                                                  100 * selfTime / totalSelf, 1e6 * total / calls))
+    return "\n".join(lines)
+
+'''
+Writes the stacks in the collapsed format, one "frame;frame;frame microseconds" line per stack
+'''
+def writeCollapsed(path):
+    with open(path, "w") as f:
+        for stack, seconds in sorted(stacks.items()):
+            microseconds = int(round(seconds * 1e6))
+            if microseconds:
+                f.write("%s %d\n" % (stack, microseconds))
@@ -1,4 +1,7 @@
+import json
+import os
 import random
+import time
 
 pieceScore = {"K": 0, "Q": 10, "R": 5, "B": 3, "N": 3, "p": 1}
 
@@ -60,9 +63,149 @@ piecePositionScores = {"N": knightScores, "Q": queenScores, "B": bishopScores, "
 
 
 
+'''
+The evaluation can be replaced by tuned values (see TexelTuner), kept in a json file with pieceScore and the tables
+named in EVALUATION_TABLES. EVALUATION_FILE is loaded when this module is imported, if it exists.
+'''
+EVALUATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "evaluation.json")
+EVALUATION_TABLES = ("knightScores", "bishopScores", "queenScores", "rookScores", "whitePawnScores", "blackPawnScores")
+
+'''
+A copy of the current piece values and piece-square tables
+'''
+def getEvaluation():
+    evaluation = {"pieceScore": dict(pieceScore)}
+    for name in EVALUATION_TABLES:
+        evaluation[name] = [list(row) for row in globals()[name]]
+    return evaluation
+
+'''
+Sets the piece values and piece-square tables that are in evaluation. The dictionary and the tables are changed in
+place, so piecePositionScores and everything else holding them sees the new values.
+'''
+def setEvaluation(evaluation):
+    pieceScore.update(evaluation.get("pieceScore", {}))
+    for name in EVALUATION_TABLES:
+        if name in evaluation:
+            table = globals()[name]
+            for row in range(8):
+                table[row][:] = evaluation[name][row]
+
+def loadEvaluation(path=EVALUATION_FILE):
+    with open(path) as f:
+        setEvaluation(json.load(f))
+
+if os.path.exists(EVALUATION_FILE):
+    loadEvaluation()
+
+#pawn structure terms, in the same units as pieceScore
+doubledPawnPenalty = 0.2    #for every extra pawn on a file
+isolatedPawnPenalty = 0.15  #no friendly pawns on the neighbouring files
+passedPawnScores = [0, 0.1, 0.1, 0.2, 0.35, 0.6, 1.0, 0]    #indexed by how many ranks the passed pawn has advanced
+pawnShieldScores = [0.1, 0.05]  #friendly pawn one and two squares in front of a king on its back rank
+
 CHECKMATE = 1000
 STALEMATE = 0
 DEPTH = 2
+TIME_LIMIT = None   #seconds per move, no new iteration of the search is started once half of it is used and the search stops when all of it is. None searches to DEPTH
+NODE_LIMIT = None   #nodes per move, the search stops when they are used up. None does not count
+EVALUATION_NOISE = 0    #standard deviation, in pawns, of the random noise added to the scores of the moves at the root
+STOP_CHECK_INTERVAL = 1    #nodes between two looks at the stop signal, a node costs far more than a look
+QUIESCENCE_DEPTH = 3    #captures searched at most this deep after the end of the main search, 0 turns it off
+PAWN_HASH_BITS = 14     #the pawn hash table has 2 ** PAWN_HASH_BITS entries
+TRANSPOSITION_BITS = 16     #the transposition table has 2 ** TRANSPOSITION_BITS entries
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2   #what the score of a transposition table entry is
+#the globals besides the piece values and tables (getEvaluation) that the score of a search to a given depth depends on
+SCORE_PARAMETERS = ("doubledPawnPenalty", "isolatedPawnPenalty", "passedPawnScores", "pawnShieldScores", "CHECKMATE",
+                    "STALEMATE", "QUIESCENCE_DEPTH")
+
+#the playing strengths offered to players, weakest first. A level sets these SmartMoveFinder globals: the node budget
+#is below what the depth takes in most positions, so it is what limits the search and a level plays the same on any
+#machine. The time budget is only a cap for a slow machine, and the noise makes the weaker levels pick worse moves
+STRENGTH_LEVELS = {
+    "beginner": {"DEPTH": 1, "NODE_LIMIT": 20, "TIME_LIMIT": 0.5, "EVALUATION_NOISE": 2.0},
+    "casual": {"DEPTH": 2, "NODE_LIMIT": 80, "TIME_LIMIT": 1.0, "EVALUATION_NOISE": 1.0},
+    "intermediate": {"DEPTH": 3, "NODE_LIMIT": 300, "TIME_LIMIT": 2.0, "EVALUATION_NOISE": 0.4},
+    "advanced": {"DEPTH": 3, "NODE_LIMIT": 1000, "TIME_LIMIT": 5.0, "EVALUATION_NOISE": 0.15},
+    "expert": {"DEPTH": 3, "NODE_LIMIT": None, "TIME_LIMIT": 10.0, "EVALUATION_NOISE": 0},
+}
+
+def setStrength(level):
+    if level not in STRENGTH_LEVELS:
+        raise ValueError("unknown strength level: %s" % level)
+    globals().update(STRENGTH_LEVELS[level])
+
+'''
+Fixed size hash table indexed by a zobrist key. Each slot keeps the full key so that collisions on the index are
+detected, and a newer entry always replaces an older one. hits and misses count the probes since the last clear.
+'''
+class HashTable():
+    name = "hash table"
+
+    def __init__(self, sizeBits):
+        self.size = 1 << sizeBits
+        self.mask = self.size - 1
+        self.keys = [None] * self.size
+        self.entries = [None] * self.size
+        self.hits = 0
+        self.misses = 0
+
+    def probe(self, key):
+        index = key & self.mask
+        if self.keys[index] == key:
+            self.hits += 1
+            return self.entries[index]
+        self.misses += 1
+        return None
+
+    def store(self, key, entry):
+        index = key & self.mask
+        self.keys[index] = key
+        self.entries[index] = entry
+
+    def clear(self):
+        self.keys = [None] * self.size
+        self.entries = [None] * self.size
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def probes(self):
+        return self.hits + self.misses
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def __str__(self):
+        return "%s: %d hits, %d misses (%.1f%% hit rate)" % (self.name, self.hits, self.misses, 100 * self.hitRate())
+
+'''
+The pawn structure evaluations, indexed by the pawn only zobrist key of the GameState
+'''
+class PawnHashTable(HashTable):
+    name = "pawn hash"
+
+    def __init__(self, sizeBits=PAWN_HASH_BITS):
+        super().__init__(sizeBits)
+
+'''
+The search results of positions, indexed by the zobrist key of the GameState. An entry is (depth, score, flag,
+moveID): the score of a search of that depth, whether it is exact or only a bound, and the best move found, which is
+searched first when the position comes up again.
+'''
+class TranspositionTable(HashTable):
+    name = "transposition table"
+
+    def __init__(self, sizeBits=TRANSPOSITION_BITS):
+        super().__init__(sizeBits)
+
+pawnHashTable = PawnHashTable()
+transpositionTable = TranspositionTable()
+searchStopEvent = None
+searchStopped = False
+searchDeadline = None   #time.time() at which the search stops, from TIME_LIMIT
+searchIterations = []   #(depth, move, score, nodes, seconds) of every completed iteration of the last findBestMove
+analysisCache = None    #an AnalysisCache, findBestMove then reuses and records its results across runs
 
 '''
 Picks and returns a  random move
@@ -108,18 +251,133 @@ def findBestMoveMinMaxNoRecursion(gs, validMoves):
 '''
 
 '''
-Helper method to make the first recursive call
+Helper method to make the first recursive call.
+The search deepens iteratively up to DEPTH and can be stopped at any time by setting stopEvent (a threading or
+multiprocessing Event), which the search polls every STOP_CHECK_INTERVAL nodes, along with the NODE_LIMIT and
+TIME_LIMIT budgets. It then returns the best move of the last completed iteration instead of nothing. After every completed iteration the move, its score (from the point of
+view of the side to move) and the depth are written to resultSlot, a multiprocessing.Array('d', 3) holding
+[moveID, score, depth], so that the GUI can read the best move so far without waiting for the search. The
+iterations are also listed in searchIterations, for the benchmarks.
+With an analysisCache, a position already searched at least DEPTH deep is answered from the cache, a shallower
+cached move is searched first, and the result is stored with its principal variation.
 '''
-def findBestMove(gs, validMoves, returnQueue):
-    global nextMove, counter
+def findBestMove(gs, validMoves, returnQueue, stopEvent=None, resultSlot=None):
+    global nextMove, counter, searchDepth, searchStopEvent, searchStopped, searchDeadline, searchIterations
     nextMove = None
     random.shuffle(validMoves)
     counter = 0
+    searchIterations = []
+    searchStopEvent = stopEvent
+    searchStopped = False
+    bestMove = None
+    startTime = time.time()
+    searchDeadline = startTime + TIME_LIMIT if TIME_LIMIT is not None else None
+    cache = analysisCache if not EVALUATION_NOISE else None     #the noisy moves of a weak level are not analysis
+    cached = cache.lookup(gs.zobristKey) if cache is not None else None
+    if cached is not None:
+        for move in validMoves:
+            if move.moveID == cached[0]:
+                if cached[2] >= DEPTH:
+                    searchIterations.append((cached[2], move, cached[1], 0, time.time() - startTime))
+                    publishResult(resultSlot, move, cached[1], cached[2])
+                    returnQueue.put(move)
+                    return
+                validMoves.remove(move)
+                validMoves.insert(0, move)
+                break
     #findMoveMinMax(gs, validMoves, DEPTH, gs.whiteToMove)                      #we can evaluate how many levels are evaluated or moves are evaluated.
     #findMoveNegaMax(gs, validMoves, DEPTH, 1 if gs.whiteToMove else -1)
-    findMoveNegaMaxAlphaBeta(gs, validMoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    print(counter)
-    returnQueue.put(nextMove)
+    for searchDepth in range(1, DEPTH + 1):
+        score = findMoveNegaMaxAlphaBeta(gs, validMoves, searchDepth, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
+        if searchStopped:   #the unfinished iteration only looked at some of the moves, keep the last complete answer
+            break
+        bestMove = nextMove
+        searchIterations.append((searchDepth, bestMove, score, counter, time.time() - startTime))
+        if bestMove is not None:
+            validMoves.remove(bestMove)     #search the best move first in the next iteration
+            validMoves.insert(0, bestMove)
+            publishResult(resultSlot, bestMove, score, searchDepth)
+        if TIME_LIMIT is not None and time.time() - startTime > TIME_LIMIT / 2:    #the next iteration would most likely not finish in time
+            break
+    if bestMove is None:    #stopped before the first iteration finished
+        bestMove = nextMove
+    elif cache is not None:
+        depth, move, score = searchIterations[-1][:3]
+        pv = principalVariation(gs, move, depth)
+        cache.store(gs.zobristKey, move.moveID, score, depth, [pvMove.moveID for pvMove in pv])
+    returnQueue.put(bestMove)
+
+'''
+Multi-PV analysis: finds the lineCount best moves, each with its score (from the point of view of the side to move)
+and principal variation. Returns a list of (move, score, pv) with the best line first, where pv is a list of moves
+starting with the move itself.
+On every iteration of the deepening the lines are searched one after the other, each one among the moves the earlier
+lines did not take. All of them share the transposition table, so the later lines find their positions already
+searched and ordered, and cost a lot less than a search of their own. Stops like findBestMove.
+'''
+def findBestLines(gs, validMoves, lineCount=3, stopEvent=None):
+    global nextMove, counter, searchDepth, searchStopEvent, searchStopped, searchDeadline
+    counter = 0
+    searchStopEvent = stopEvent
+    searchStopped = False
+    turnMultiplier = 1 if gs.whiteToMove else -1
+    rootMoves = list(validMoves)
+    random.shuffle(rootMoves)
+    lines = []
+    startTime = time.time()
+    searchDeadline = startTime + TIME_LIMIT if TIME_LIMIT is not None else None
+    for searchDepth in range(1, DEPTH + 1):
+        depthLines = []
+        remainingMoves = list(rootMoves)
+        while remainingMoves and len(depthLines) < lineCount:
+            nextMove = None
+            score = findMoveNegaMaxAlphaBeta(gs, remainingMoves, searchDepth, -CHECKMATE, CHECKMATE, turnMultiplier)
+            if searchStopped or nextMove is None:
+                break
+            remainingMoves.remove(nextMove)
+            depthLines.append((nextMove, score))
+        if searchStopped:
+            break
+        #the lines of this iteration are searched first in the next one, in their order
+        rootMoves = [move for move, score in depthLines] + remainingMoves
+        lines = [(move, score, principalVariation(gs, move, searchDepth)) for move, score in depthLines]
+        if TIME_LIMIT is not None and time.time() - startTime > TIME_LIMIT / 2:
+            break
+    return lines
+
+'''
+The line starting with move, following the best moves of the transposition table for at most depth moves
+'''
+def principalVariation(gs, move, depth):
+    pv = [move]
+    gs.makeMove(move)
+    while len(pv) < depth:
+        entry = transpositionTable.probe(gs.zobristKey)
+        if entry is None:
+            break
+        nextPVMove = None
+        for validMove in gs.getValidMoves():
+            if validMove.moveID == entry[3]:
+                nextPVMove = validMove
+                break
+        if nextPVMove is None:
+            break
+        pv.append(nextPVMove)
+        gs.makeMove(nextPVMove)
+    for i in range(len(pv)):
+        gs.undoMove()
+    return pv
+
+'''
+Writes the result of a completed iteration into the shared result slot
+'''
+def publishResult(resultSlot, move, score, depth):
+    if resultSlot is None:
+        return
+    with resultSlot.get_lock():
+        resultSlot[0] = move.moveID
+        resultSlot[1] = score
+        resultSlot[2] = depth
 
 def findMoveMinMax(gs, validMoves, depth, whiteToMove):
     global nextMove
@@ -172,27 +430,117 @@ def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
 def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
     global nextMove, counter
     counter += 1
+    if counter % STOP_CHECK_INTERVAL == 0:
+        checkStop()
+    if searchStopped:   #unwind, the scores returned from here on are never used
+        return 0
     if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
+        return findMoveQuiescence(gs, validMoves, QUIESCENCE_DEPTH, alpha, beta, turnMultiplier)
+
+    #the root is not looked up, its moves are ordered by findBestMove and it has to set nextMove
+    isRoot = depth == searchDepth
+    originalAlpha = alpha
+    if not isRoot:
+        entry = transpositionTable.probe(gs.zobristKey)
+        if entry is not None:
+            entryDepth, entryScore, flag, entryMoveID = entry
+            if entryDepth >= depth:
+                if flag == EXACT or (flag == LOWER_BOUND and entryScore >= beta) or (flag == UPPER_BOUND and entryScore <= alpha):
+                    return entryScore
+        orderMoves(gs, validMoves)  #only for the nodes that are searched, a cutoff does not pay for the exchanges
+        if entry is not None:
+            #move ordering - the best move of an earlier search of this position goes first
+            for i in range(1, len(validMoves)):
+                if validMoves[i].moveID == entryMoveID:
+                    validMoves.insert(0, validMoves.pop(i))
+                    break
 
-    #move ordering - we want to evaluate the best moves first and we don't want to look at the branches which have worse moves  (implement later)
     maxScore = -CHECKMATE
+    bestMove = None
     for move in validMoves:
         gs.makeMove(move)
         nextMoves = gs.getValidMoves()
         score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth-1, -beta, -alpha, -turnMultiplier)   #calling this recursively   #-beta becomes our new alpha and vice versa
+        if searchStopped:
+            gs.undoMove()
+            return maxScore
+        if isRoot and EVALUATION_NOISE:
+            score += random.gauss(0, EVALUATION_NOISE)
         if score > maxScore:
             maxScore = score
-            if depth == DEPTH:
+            bestMove = move
+            if isRoot:
                 nextMove = move
-                print(move, score)
         gs.undoMove()
         if maxScore > alpha: #pruning happens
             alpha = maxScore
         if alpha >= beta:
             break
+    if not isRoot:
+        if maxScore <= originalAlpha:
+            flag = UPPER_BOUND
+        elif maxScore >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        transpositionTable.store(gs.zobristKey, (depth, maxScore, flag, bestMove.moveID if bestMove else None))
     return maxScore
 
+'''
+Looked at every STOP_CHECK_INTERVAL nodes: the search stops when the stop signal is set, NODE_LIMIT nodes have been
+searched or the TIME_LIMIT of the move is up
+'''
+def checkStop():
+    global searchStopped
+    if (searchStopEvent is not None and searchStopEvent.is_set()) or (NODE_LIMIT is not None and counter >= NODE_LIMIT) \
+            or (searchDeadline is not None and time.time() >= searchDeadline):
+        searchStopped = True
+
+'''
+Quiescence search: at the end of the main search only captures are searched on, so that a capture on the last move is
+not scored without the recapture. The player to move can always stand pat on the evaluation instead, and captures that
+lose material by static exchange evaluation are not searched at all.
+'''
+def findMoveQuiescence(gs, validMoves, depth, alpha, beta, turnMultiplier):
+    global counter
+    maxScore = turnMultiplier * scoreBoard(gs)
+    if depth == 0 or gs.checkMate or gs.staleMate or maxScore >= beta:
+        return maxScore
+    if maxScore > alpha:
+        alpha = maxScore
+    captures = [(gs.staticExchange(move, pieceScore), move) for move in validMoves if move.isCapture]
+    captures.sort(key=lambda capture: -capture[0])
+    for exchange, move in captures:
+        if exchange < 0:    #losing captures are pruned, and the rest of the list is losing as well
+            break
+        counter += 1
+        if counter % STOP_CHECK_INTERVAL == 0:
+            checkStop()
+        if searchStopped:
+            return maxScore
+        gs.makeMove(move)
+        score = -findMoveQuiescence(gs, gs.getValidMoves(), depth - 1, -beta, -alpha, -turnMultiplier)
+        gs.undoMove()
+        if score > maxScore:
+            maxScore = score
+        if maxScore > alpha:
+            alpha = maxScore
+        if alpha >= beta:
+            break
+    return maxScore
+
+'''
+Move ordering: captures that win or hold material by static exchange evaluation first, the biggest gain first, then the
+quiet moves and last the captures that lose material. The sort is stable, so the order of the quiet moves is kept.
+'''
+def orderMoves(gs, validMoves):
+    def orderKey(move):
+        if not move.isCapture:
+            return 0
+        exchange = gs.staticExchange(move, pieceScore)
+        return -exchange - 1 if exchange >= 0 else CHECKMATE - exchange
+    validMoves.sort(key=orderKey)
+
 '''
 A positive score is good for white, a negative score is good for black
 '''
@@ -214,16 +562,84 @@ def scoreBoard(gs):
                 if square[1] != "K":    #no position table for king
                     if square[1] == "p":    #for pawns
                         piecePositionScore = piecePositionScores[square][row][col]
-                    else:       #other pieces
-                        piecePositionScore = piecePositionScores[square[1]][row][col]   #searches the dictionary as it looks up in the table and gets the number
+                    else:       #other pieces, the tables are from white's side of the board so black looks them up upside down
+                        piecePositionScore = piecePositionScores[square[1]][row if square[0] == 'w' else 7 - row][col]   #searches the dictionary as it looks up in the table and gets the number
 
             if square[0] == 'w':
                 score += pieceScore[square[1]] + piecePositionScore * .1
             elif square[0] == 'b':
                 score -= pieceScore[square[1]] + piecePositionScore * .1
 
+    score += scorePawnStructure(gs)
     return score
 
+'''
+Pawn structure part of the evaluation, looked up in the pawn hash table by the pawn key and only computed on a miss.
+The king shield depends on the king, so the table stores it for every file the king could be on.
+'''
+def scorePawnStructure(gs):
+    entry = pawnHashTable.probe(gs.pawnKey)
+    if entry is None:
+        entry = evaluatePawns(gs.board)
+        pawnHashTable.store(gs.pawnKey, entry)
+    score, whiteShield, blackShield = entry
+    if gs.whiteKingLocation[0] == 7:
+        score += whiteShield[gs.whiteKingLocation[1]]
+    if gs.blackKingLocation[0] == 0:
+        score -= blackShield[gs.blackKingLocation[1]]
+    return score
+
+'''
+Scores doubled, isolated and passed pawns (positive is good for white) and the pawn shield for a king on each file of
+its back rank. Returns (score, whiteShield, blackShield).
+'''
+def evaluatePawns(board):
+    whitePawns = [[] for c in range(8)]     #rows of the white pawns on every file
+    blackPawns = [[] for c in range(8)]
+    for r in range(1, 7):
+        for c in range(8):
+            if board[r][c] == 'wp':
+                whitePawns[c].append(r)
+            elif board[r][c] == 'bp':
+                blackPawns[c].append(r)
+
+    score = 0
+    for c in range(8):
+        neighbourFiles = [f for f in (c - 1, c + 1) if 0 <= f < 8]
+        adjacentFiles = neighbourFiles + [c]
+        #doubled pawns
+        if len(whitePawns[c]) > 1:
+            score -= doubledPawnPenalty * (len(whitePawns[c]) - 1)
+        if len(blackPawns[c]) > 1:
+            score += doubledPawnPenalty * (len(blackPawns[c]) - 1)
+        #isolated pawns
+        if whitePawns[c] and not any(whitePawns[f] for f in neighbourFiles):
+            score -= isolatedPawnPenalty * len(whitePawns[c])
+        if blackPawns[c] and not any(blackPawns[f] for f in neighbourFiles):
+            score += isolatedPawnPenalty * len(blackPawns[c])
+        #passed pawns - no enemy pawn in front on the same or the neighbouring files
+        for r in whitePawns[c]:
+            if not any(br < r for f in adjacentFiles for br in blackPawns[f]):
+                score += passedPawnScores[7 - r]
+        for r in blackPawns[c]:
+            if not any(wr > r for f in adjacentFiles for wr in whitePawns[f]):
+                score -= passedPawnScores[r]
+
+    #pawn shield for a king on its back rank
+    whiteShield = []
+    blackShield = []
+    for kingCol in range(8):
+        whiteScore = blackScore = 0
+        for c in range(max(0, kingCol - 1), min(8, kingCol + 2)):
+            for i in range(len(pawnShieldScores)):
+                if board[6 - i][c] == 'wp':
+                    whiteScore += pawnShieldScores[i]
+                if board[1 + i][c] == 'bp':
+                    blackScore += pawnShieldScores[i]
+        whiteShield.append(whiteScore)
+        blackShield.append(blackScore)
+    return score, whiteShield, blackShield
+
 
 
 
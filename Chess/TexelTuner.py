@@ -0,0 +1,297 @@
+"""
+Texel tuning of the piece values and piece-square tables of SmartMoveFinder.
+
+The positions of a game database are labelled with the result of their game (1, 0.5 or 0 for white). The tuner looks
+for the evaluation parameters whose score, squashed into an expected result by sigmoid(K * score), has the smallest
+mean squared error against those labels.
+
+The evaluation is linear in the tuned parameters. A position is therefore loaded once into NumPy arrays:
+    - the material difference (white minus black count of p, N, B, R, Q) per position,
+    - a sparse list of (position, table entry, +1 for white or -1 for black) with one item per piece,
+    - the part of the score that is not tuned (the pawn structure).
+Every gradient step is then a handful of vectorized operations over all the positions. Loading runs on a process pool.
+
+Piece-square tables are tuned from white's side of the board. A black piece at row r uses the entry at row 7 - r, the
+way scoreBoard looks them up. The pawns have a table for each side, as in scoreBoard, tuned separately and starting
+from whitePawnScores and blackPawnScores, which are not mirror images of each other.
+
+NumPy is only needed here, not by the engine.
+
+Usage (from the repository root):
+    python -m Chess.TexelTuner games.pgn [more.pgn ...] [--epd positions.epd] [--epochs 300] [--out Chess/evaluation.json]
+The default output is the file SmartMoveFinder loads on import, so the next engine started uses the tuned values.
+"""
+import argparse
+import json
+import math
+import re
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from Chess import ChessEngine, PGN, SmartMoveFinder
+
+MATERIAL_PIECES = "pNBRQ"   #the king has no value to tune
+TABLE_PIECES = ("N", "B", "R", "Q", "wp", "bp")    #keys of piecePositionScores, in the order of the parameter vector
+TABLE_NAMES = {"N": "knightScores", "B": "bishopScores", "R": "rookScores", "Q": "queenScores", "wp": "whitePawnScores",
+               "bp": "blackPawnScores"}
+TABLE_SCALE = 0.1       #scoreBoard adds a piece-square table entry times this
+SKIP_PLIES = 8          #the opening moves of a game say little about its result
+GAMES_PER_TASK = 100
+LINES_PER_TASK = 5000
+epdResultPattern = re.compile(r'"?(1-0|0-1|1/2-1/2)"?|\[(1\.0|0\.5|0\.0|1|0)\]')
+RESULT_VALUES = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5, "1.0": 1.0, "1": 1.0, "0.5": 0.5, "0.0": 0.0, "0": 0.0}
+
+
+class PositionFeatures():
+    def __init__(self):
+        self.material = []      #per position, white minus black count of MATERIAL_PIECES
+        self.rows = []          #sparse table features: position number,
+        self.columns = []       #table entry (index of the table in TABLE_PIECES * 64 + row * 8 + col),
+        self.signs = []         #and +1 for a white piece or -1 for a black one
+        self.fixed = []         #the score that is not tuned
+        self.results = []
+
+    def add(self, gs, result):
+        position = len(self.results)
+        material = [0] * len(MATERIAL_PIECES)
+        board = gs.board
+        for r in range(8):
+            for c in range(8):
+                square = board[r][c]
+                if square == "--" or square[1] == 'K':
+                    continue
+                sign = 1 if square[0] == 'w' else -1
+                material[MATERIAL_PIECES.index(square[1])] += sign
+                self.rows.append(position)
+                if square[1] == 'p':    #a table for each side, looked up as it is
+                    self.columns.append(TABLE_PIECES.index(square) * 64 + r * 8 + c)
+                else:
+                    self.columns.append(TABLE_PIECES.index(square[1]) * 64 + (r if sign == 1 else 7 - r) * 8 + c)
+                self.signs.append(sign)
+        self.material.append(material)
+        self.fixed.append(SmartMoveFinder.scorePawnStructure(gs))
+        self.results.append(result)
+
+    '''
+    The features as NumPy arrays, small types to keep millions of positions in memory
+    '''
+    def arrays(self):
+        return (np.array(self.material, dtype=np.int8).reshape(-1, len(MATERIAL_PIECES)),
+                np.array(self.rows, dtype=np.int32), np.array(self.columns, dtype=np.int16),
+                np.array(self.signs, dtype=np.int8), np.array(self.fixed, dtype=np.float32),
+                np.array(self.results, dtype=np.float32))
+
+'''
+Runs in a worker: the features of the quiet positions of a batch of games. A position is skipped in the first
+SKIP_PLIES plies, when the move before or after it is a capture or the move before it gives check, since the static
+evaluation cannot be right about it. A game starts from its FEN tag, if any; games with a bad one are skipped and the
+others are cut at their first move that can not be played.
+'''
+def gamesFeatures(games):
+    features = PositionFeatures()
+    for game in games:
+        if game.result not in RESULT_VALUES:
+            continue
+        result = RESULT_VALUES[game.result]
+        try:
+            gs = game.startPosition()
+        except ValueError:
+            continue
+        moves = game.moves
+        for ply in range(len(moves)):
+            if ply >= SKIP_PLIES and 'x' not in moves[ply] and 'x' not in moves[ply - 1] and '+' not in moves[ply - 1]:
+                features.add(gs, result)
+            try:
+                gs.makeMove(gs.parseSAN(moves[ply]))
+            except (ValueError, KeyError, IndexError):     #KeyError and IndexError from a position without a king, say
+                break
+    return features.arrays()
+
+'''
+Runs in a worker: the features of EPD lines, a FEN followed by the result ("1-0", c9 "1/2-1/2"; or [0.5])
+'''
+def epdFeatures(lines):
+    features = PositionFeatures()
+    gs = ChessEngine.GameState()
+    for line in lines:
+        match = epdResultPattern.search(line)
+        if match is None:
+            continue
+        gs.setFEN(" ".join(line.split()[:4]))
+        features.add(gs, RESULT_VALUES[match.group(1) or match.group(2)])
+    return features.arrays()
+
+def epdBatches(paths):
+    batch = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                batch.append(line)
+                if len(batch) == LINES_PER_TASK:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+'''
+Loads the positions of the PGN and EPD files on a process pool and joins the features into one set of arrays
+'''
+def loadPositions(pgnPaths, epdPaths, processes=None, maxPositions=None):
+    parts = []
+    positions = 0
+    startTime = time.time()
+    with Pool(processes) as pool:
+        for function, batches in ((gamesFeatures, PGN.readGameBatches(pgnPaths, GAMES_PER_TASK)),
+                                  (epdFeatures, epdBatches(epdPaths))):
+            for part in pool.imap(function, batches):
+                parts.append(part)
+                positions += len(part[5])
+                print("%d positions, %.0f positions/s" % (positions, positions / (time.time() - startTime)), end="\r")
+                if maxPositions is not None and positions >= maxPositions:
+                    break
+            if maxPositions is not None and positions >= maxPositions:
+                break
+    print()
+    if not parts:
+        raise ValueError("no labelled positions found")
+    offsets = np.cumsum([0] + [len(part[5]) for part in parts[:-1]])
+    material = np.concatenate([part[0] for part in parts]).astype(np.float32)
+    rows = np.concatenate([part[1] + offset for part, offset in zip(parts, offsets)])
+    columns = np.concatenate([part[2] for part in parts])
+    signs = np.concatenate([part[3] for part in parts]).astype(np.float32)
+    fixed = np.concatenate([part[4] for part in parts])
+    results = np.concatenate([part[5] for part in parts])
+    return material, rows, columns, signs, fixed, results
+
+
+'''
+The parameter vector of the current evaluation: the MATERIAL_PIECES values, then the TABLE_PIECES tables
+'''
+def currentParameters():
+    parameters = [SmartMoveFinder.pieceScore[piece] for piece in MATERIAL_PIECES]
+    for piece in TABLE_PIECES:
+        table = getattr(SmartMoveFinder, TABLE_NAMES[piece])
+        parameters.extend(table[r][c] for r in range(8) for c in range(8))
+    return np.array(parameters, dtype=np.float64)
+
+'''
+The evaluation of a parameter vector, in the form SmartMoveFinder.setEvaluation takes and loadEvaluation reads
+'''
+def parametersToEvaluation(parameters, decimals=2):
+    pieceScore = dict(SmartMoveFinder.pieceScore)
+    for i, piece in enumerate(MATERIAL_PIECES):
+        pieceScore[piece] = round(float(parameters[i]), decimals)
+    evaluation = {"pieceScore": pieceScore}
+    for i, piece in enumerate(TABLE_PIECES):
+        entries = parameters[len(MATERIAL_PIECES) + 64 * i:len(MATERIAL_PIECES) + 64 * (i + 1)]
+        evaluation[TABLE_NAMES[piece]] = [[round(float(entries[r * 8 + c]), decimals) for c in range(8)] for r in range(8)]
+    return evaluation
+
+
+class TexelTuner():
+    def __init__(self, material, rows, columns, signs, fixed, results):
+        self.material = material
+        self.rows = rows
+        self.columns = columns
+        self.signedScale = signs * TABLE_SCALE
+        self.fixed = fixed
+        self.results = results
+        self.count = len(results)
+        self.tableSize = 64 * len(TABLE_PIECES)
+
+    '''
+    The scores of all the positions for a parameter vector
+    '''
+    def scores(self, parameters):
+        materialParameters = parameters[:len(MATERIAL_PIECES)]
+        tableParameters = parameters[len(MATERIAL_PIECES):]
+        tableScores = np.bincount(self.rows, weights=self.signedScale * tableParameters[self.columns], minlength=self.count)
+        return self.material @ materialParameters + tableScores + self.fixed
+
+    def error(self, parameters, k):
+        return float(np.mean((self.results - 1 / (1 + np.exp(-k * self.scores(parameters)))) ** 2))
+
+    '''
+    The scaling constant K of the sigmoid that fits the results best for the starting parameters, by golden section
+    search
+    '''
+    def fitK(self, parameters, low=0.01, high=10.0, iterations=40):
+        scores = self.scores(parameters)
+        error = lambda k: float(np.mean((self.results - 1 / (1 + np.exp(-k * scores))) ** 2))
+        ratio = (math.sqrt(5) - 1) / 2
+        a, b = high - ratio * (high - low), low + ratio * (high - low)
+        errorA, errorB = error(a), error(b)
+        for i in range(iterations):
+            if errorA < errorB:
+                high, b, errorB = b, a, errorA
+                a = high - ratio * (high - low)
+                errorA = error(a)
+            else:
+                low, a, errorA = a, b, errorB
+                b = low + ratio * (high - low)
+                errorB = error(b)
+        return (low + high) / 2
+
+    '''
+    The gradient of the mean squared error for all the parameters, and the error
+    '''
+    def gradient(self, parameters, k):
+        expected = 1 / (1 + np.exp(-k * self.scores(parameters)))
+        difference = expected - self.results
+        scoreGradient = 2 * k * difference * expected * (1 - expected) / self.count
+        materialGradient = self.material.T @ scoreGradient
+        tableGradient = np.bincount(self.columns, weights=self.signedScale * scoreGradient[self.rows],
+                                    minlength=self.tableSize)
+        return np.concatenate([materialGradient, tableGradient]), float(np.mean(difference ** 2))
+
+    '''
+    Minimizes the error with Adam steps over all the positions at once. Returns the tuned parameters.
+    '''
+    def tune(self, parameters, k, epochs=300, learningRate=0.05, report=25):
+        parameters = parameters.copy()
+        firstMoment = np.zeros_like(parameters)
+        secondMoment = np.zeros_like(parameters)
+        beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+        for epoch in range(1, epochs + 1):
+            gradient, error = self.gradient(parameters, k)
+            firstMoment = beta1 * firstMoment + (1 - beta1) * gradient
+            secondMoment = beta2 * secondMoment + (1 - beta2) * gradient ** 2
+            step = (firstMoment / (1 - beta1 ** epoch)) / (np.sqrt(secondMoment / (1 - beta2 ** epoch)) + epsilon)
+            parameters -= learningRate * step
+            if epoch % report == 0 or epoch == 1:
+                print("epoch %4d: error %.6f" % (epoch, error))
+        return parameters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune the piece values and piece-square tables on labelled positions")
+    parser.add_argument("pgn", nargs="*", help="PGN files, positions are labelled with the result of their game")
+    parser.add_argument("--epd", nargs="*", default=[], help="EPD files with the result on every line")
+    parser.add_argument("--out", default=SmartMoveFinder.EVALUATION_FILE)
+    parser.add_argument("--epochs", type=int, default=300)
+    parser.add_argument("--learning-rate", type=float, default=0.05)
+    parser.add_argument("--max-positions", type=int, default=None)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args(argv)
+    if not args.pgn and not args.epd:
+        parser.error("no positions to tune on")
+
+    startTime = time.time()
+    tuner = TexelTuner(*loadPositions(args.pgn, args.epd, args.processes, args.max_positions))
+    print("%d positions loaded in %.1f s" % (tuner.count, time.time() - startTime))
+    parameters = currentParameters()
+    k = tuner.fitK(parameters)
+    print("K = %.4f, starting error %.6f" % (k, tuner.error(parameters, k)))
+    startTime = time.time()
+    parameters = tuner.tune(parameters, k, args.epochs, args.learning_rate)
+    print("tuned in %.1f s, final error %.6f" % (time.time() - startTime, tuner.error(parameters, k)))
+    evaluation = parametersToEvaluation(parameters)
+    print("piece values: " + ", ".join("%s=%g" % item for item in evaluation["pieceScore"].items()))
+    with open(args.out, "w") as f:
+        json.dump(evaluation, f, indent=1)
+    print("written to " + args.out)
+
+if __name__ == "__main__":
+    main()
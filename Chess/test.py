@@ -0,0 +1,114 @@
+"""
+Regression tests.
+
+Usage (from the repository root):
+    python -m unittest Chess.test
+"""
+import asyncio
+import io
+import math
+import unittest
+
+from Chess import ChessEngine, GameServer, MatchRunner, MateSearch, PGN, PositionIndex
+
+
+def readGame(movetext, headers=""):
+    return next(PGN.readGames(io.StringIO(headers + '[Result "*"]\n\n' + movetext + " *\n")))
+
+
+class ParseSANTest(unittest.TestCase):
+    def testCastleAfterTheKingLeftRaisesValueError(self):
+        game = readGame("1. e4 e5 2. Ke2 Ke7 3. Kd3 Kd6 4. O-O")
+        with self.assertRaises(ValueError):
+            game.replay()
+
+    def testCastleThroughAPieceRaisesValueError(self):
+        gs = ChessEngine.GameState()
+        for san in ("O-O", "O-O-O"):
+            with self.assertRaises(ValueError):
+                gs.parseSAN(san)
+
+    def testCastle(self):
+        gs = readGame("1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O").replay()
+        self.assertEqual(gs.board[7][6], "wK")
+        self.assertEqual(gs.board[7][5], "wR")
+
+
+class PGNTest(unittest.TestCase):
+    def testReplayStartsFromTheFEN(self):
+        game = readGame("1. O-O O-O-O", '[SetUp "1"]\n[FEN "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1"]\n')
+        gs = game.replay(strict=True)
+        self.assertEqual(gs.board[7][6], "wK")
+        self.assertEqual(gs.board[0][2], "bK")
+        self.assertEqual(gs.board[1], ["--"] * 8)
+
+    def testBadFENRaisesValueError(self):
+        game = readGame("1. e4", '[FEN "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq z9 0 1"]\n')
+        with self.assertRaises(ValueError):
+            game.replay()
+
+
+class PositionIndexTest(unittest.TestCase):
+    def testGameRecordsStopAtTheBadMove(self):
+        records = PositionIndex.gameRecords(readGame("1. e4 e5 2. Ke2 Ke7 3. Kd3 Kd6 4. O-O"))
+        self.assertEqual([PositionIndex.decodeMove(record[1]) for record in records],
+                         ["e2e4", "e7e5", "e1e2", "e8e7", "e2d3", "e7d6", None])
+
+    def testGameRecordsStartFromTheFEN(self):
+        fen = "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1"
+        gs = ChessEngine.GameState()
+        gs.setFEN(fen)
+        records = PositionIndex.gameRecords(readGame("1. O-O O-O-O", '[FEN "%s"]\n' % fen))
+        self.assertEqual(records[0][0], gs.zobristKey)
+        self.assertEqual(len(records), 3)
+
+    def testGameRecordsOfABadFEN(self):
+        self.assertEqual(PositionIndex.gameRecords(readGame("1. e4", '[FEN "8/8/8/8/8/8/8/8 w - z9 0 1"]\n')), [])
+
+
+class EloTest(unittest.TestCase):
+    def testNoGames(self):
+        self.assertEqual(MatchRunner.eloDifference(0, 0, 0), (None, None, None))
+        self.assertEqual(MatchRunner.sprt(0, 0, 0)[3], "inconclusive")
+
+    def testEveryGameWonHasNoInterval(self):
+        self.assertEqual(MatchRunner.eloDifference(1, 0, 0), (math.inf, None, None))
+
+    def testIntervalReachingAPerfectScoreIsUnbounded(self):
+        elo, lower, upper = MatchRunner.eloDifference(3, 0, 1)
+        self.assertAlmostEqual(elo, 190.85, 2)
+        self.assertLess(lower, elo)
+        self.assertEqual(upper, math.inf)
+
+
+class MateSearchTest(unittest.TestCase):
+    def testMateWithTheLongestDefence(self):
+        self.assertEqual(MateSearch.findMate("1r5k/6pp/8/6N1/2Q5/8/8/6K1 w - -", 4),
+                         (4, ["Nf7+", "Kg8", "Nh6+", "Kh8", "Qg8+", "Rxg8", "Nf7#"]))
+
+    def testNoMate(self):
+        self.assertEqual(MateSearch.findMate("8/8/4k3/3p4/3P4/4K3/8/8 w - -", 2), (None, []))
+
+
+class GameServerTest(unittest.TestCase):
+    def request(self, request):
+        async def handle():
+            server = GameServer.GameServer(1)
+            server.startDispatchers()
+            try:
+                return await server.handleRequest(request)
+            finally:
+                server.close()
+        return asyncio.run(handle())
+
+    def testUnknownCommand(self):
+        with self.assertRaisesRegex(GameServer.ServerError, "unknown command bogus"):
+            self.request({"cmd": "bogus"})
+
+    def testUnknownGame(self):
+        with self.assertRaisesRegex(GameServer.ServerError, "unknown game 7"):
+            self.request({"cmd": "state", "game": 7})
+
+
+if __name__ == "__main__":
+    unittest.main()